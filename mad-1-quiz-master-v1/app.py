@@ -1,12 +1,33 @@
+from flask import Flask
 
-from flask import Flask, render_template
+# The application modules register their routes and commands on this app when
+# create_app() imports them. Run it with `flask --app "app:create_app()"`.
 app = Flask(__name__)
 
-from application import config
-from application import models
-from application import routes
+
+def create_app():
+    """Return the app with config, models, routes and commands registered.
+
+    Calling it again returns the same app. No database work happens here, the
+    schema and admin user are created once with `flask init-db`.
+    """
+    from application import config
+    from application import models
+    from application import search
+    from application import routes
+    from application import explain
+    from application import bootstrap
+    return app
+
 
 if __name__ == "__main__":
     # If someone is importing this file then this code will not run. It will run only if
     # you are running the file.
-    app.run(debug=True)
\ No newline at end of file
+    # As a script this file is __main__, the application modules use the app of the "app" module.
+    from app import create_app
+    from application.bootstrap import init_db
+
+    app = create_app()
+    with app.app_context():
+        init_db()
+    app.run(debug=True)
@@ -0,0 +1,110 @@
+import hashlib
+from threading import Lock
+
+from application.models import db, Question
+from application import catalog
+
+
+# ------------ Per-quiz answer key cache ------------
+
+# numpy is imported inside the functions that use it, so starting the app does not pay for it.
+
+# quiz_id -> (catalog version, question ids, correct options, layout), ids and options as
+# compact int arrays. Entries from an older catalog version are reloaded, which keeps the caches of
+# several worker processes coherent.
+_answer_keys = {}
+_lock = Lock()
+
+
+def get_answer_key(quiz_id):
+    import numpy as np
+
+    version = catalog.current_version()
+    entry = _answer_keys.get(quiz_id)
+    if entry is not None and entry[0] == version:
+        return entry[1:3]
+
+    rows = db.session.execute(
+        db.select(Question.question_id, Question.correct_option)
+        .filter_by(quiz_id=quiz_id)
+        .order_by(Question.question_id)
+    ).all()
+    question_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    correct_options = np.fromiter((row[1] for row in rows), dtype=np.int8, count=len(rows))
+    with _lock:
+        _answer_keys[quiz_id] = (version, question_ids, correct_options, layout_id(question_ids))
+    return question_ids, correct_options
+
+
+def get_layout(quiz_id):
+    question_ids, _ = get_answer_key(quiz_id)
+    entry = _answer_keys.get(quiz_id)
+    # the entry may have been dropped by another thread in between
+    return entry[3] if entry is not None and entry[1] is question_ids else layout_id(question_ids)
+
+
+def invalidate(quiz_id=None):
+    # without a quiz id the whole cache is dropped, e.g. after a chapter or subject delete
+    with _lock:
+        if quiz_id is None:
+            _answer_keys.clear()
+        else:
+            _answer_keys.pop(quiz_id, None)
+
+
+def option(value):
+    # checked before it reaches numpy, where a huge integer would overflow
+    value = int(value or 0)
+    if not 0 <= value <= 4:
+        raise ValueError(f"{value} is not an option")
+    return value
+
+
+def grade(quiz_id, form):
+    """Return (correct answers, total questions, answer sheet) for a submitted quiz form.
+
+    Unanswered questions count as 0 and raise no error, an answer that is not
+    an option from 0 to 4 raises ValueError. The answer sheet is a (layout, packed answers)
+    pair, see pack_answers.
+    """
+    import numpy as np
+
+    question_ids, correct_options = get_answer_key(quiz_id)
+    answers = np.array([option(form.get(str(qid))) for qid in question_ids.tolist()],
+                       dtype=np.int8)
+    score = int(np.count_nonzero(answers == correct_options))
+    return score, len(question_ids), (get_layout(quiz_id), pack_answers(answers))
+
+
+# ------------ Packed answer sheets ------------
+
+# An answer sheet stores one option per question, 0 for unanswered, as a 4-bit nibble in
+# question id order, so a 100 question attempt takes 50 bytes. The layout id identifies the
+# question ids the sheet is aligned to; sheets of an older layout are not comparable.
+
+def layout_id(question_ids):
+    digest = hashlib.blake2b(question_ids.tobytes(), digest_size=8).digest()
+    # signed, so it fits an SQLite integer
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def pack_answers(answers):
+    import numpy as np
+
+    answers = np.asarray(answers, dtype=np.int64)
+    # anything that is not one of the four options is stored as unanswered
+    nibbles = np.where((answers >= 1) & (answers <= 4), answers, 0).astype(np.uint8)
+    if len(nibbles) % 2:
+        nibbles = np.append(nibbles, np.uint8(0))
+    return (nibbles[0::2] | (nibbles[1::2] << 4)).tobytes()
+
+
+def unpack_answers(sheets, question_count):
+    """Unpack equally long answer sheets into an (attempts, questions) int8 matrix."""
+    import numpy as np
+
+    packed = np.frombuffer(b"".join(sheets), dtype=np.uint8).reshape(len(sheets), -1)
+    answers = np.empty((len(sheets), packed.shape[1] * 2), dtype=np.int8)
+    answers[:, 0::2] = packed & 0x0F
+    answers[:, 1::2] = packed >> 4
+    return answers[:, :question_count]
@@ -0,0 +1,181 @@
+import json
+from collections import Counter
+from datetime import datetime, time, timedelta
+
+import click
+from sqlalchemy.dialects.sqlite import insert
+
+from app import app
+from application.models import db, Score, ScoreArchive, AnswerSheet, AnswerSheetArchive, \
+    UserScoreRollup, QuizScoreRollup
+
+
+# ------------ Score archival ------------
+
+# `flask archive-scores` moves scores older than SCORE_ARCHIVE_DAYS from Score to
+# ScoreArchive in batches, one transaction each, with their answer sheets, and adds
+# them to daily and weekly rollups per user and per quiz. Score then only holds recent attempts; pages that
+# show older history read the rollups, which are exact.
+
+SCORE_COLUMNS = ["score_id", "quiz_id", "user_id", "time_stamp_of_attempt", "total_score"]
+SHEET_COLUMNS = ["score_id", "quiz_id", "layout", "answers"]
+
+
+def periods(time_stamp):
+    day = time_stamp.date()
+    return [("day", day), ("week", day - timedelta(days=day.weekday()))]
+
+
+def add_rollups(model, owner_column, totals):
+    """Add {(owner id, period, period start): [attempts, sum, max, Counter]} to the rollups."""
+    if not totals:
+        return
+    owner = getattr(model, owner_column)
+    keys = list(totals)
+    existing = db.session.execute(
+        db.select(owner, model.period, model.period_start, model.attempts, model.score_sum,
+                  model.max_score, model.histogram)
+        .filter(db.tuple_(owner, model.period, model.period_start).in_(keys))).all()
+    for owner_id, period, start, attempts, score_sum, max_score, histogram in existing:
+        total = totals[(owner_id, period, start)]
+        total[0] += attempts
+        total[1] += score_sum
+        total[2] = max(total[2], max_score)
+        total[3].update({int(score): count for score, count in json.loads(histogram).items()})
+
+    write_rollups(model, owner_column, totals)
+
+
+def write_rollups(model, owner_column, totals):
+    owner = getattr(model, owner_column)
+    rows = [{owner_column: owner_id, "period": period, "period_start": start,
+             "attempts": attempts, "score_sum": score_sum, "max_score": max_score,
+             "histogram": json.dumps(dict(sorted(histogram.items())))}
+            for (owner_id, period, start), (attempts, score_sum, max_score, histogram)
+            in totals.items()]
+    if not rows:
+        return
+    statement = insert(model)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=[owner, model.period, model.period_start],
+        set_={name: statement.excluded[name]
+              for name in ("attempts", "score_sum", "max_score", "histogram")}), rows)
+
+
+def remove_rollups(model, owner_column, scores):
+    """Subtract deleted archived scores, (owner id, time stamp, total_score), from the rollups.
+
+    Runs inside the caller's transaction. The best score of a period is taken from
+    what is left of its histogram; periods left without attempts are deleted.
+    """
+    removed = {}
+    for owner_id, time_stamp, score in scores:
+        if owner_id is None or time_stamp is None:
+            continue
+        for period, start in periods(time_stamp):
+            removed.setdefault((owner_id, period, start), Counter())[score or 0] += 1
+    if not removed:
+        return
+    owner = getattr(model, owner_column)
+    existing = db.session.execute(
+        db.select(owner, model.period, model.period_start, model.histogram)
+        .filter(db.tuple_(owner, model.period, model.period_start).in_(list(removed)))).all()
+    totals = {}
+    emptied = []
+    for owner_id, period, start, histogram in existing:
+        histogram = Counter({int(score): count for score, count in json.loads(histogram).items()})
+        histogram.subtract(removed[(owner_id, period, start)])
+        histogram = +histogram
+        if histogram:
+            totals[(owner_id, period, start)] = [
+                histogram.total(), sum(score * count for score, count in histogram.items()),
+                max(histogram), histogram]
+        else:
+            emptied.append((owner_id, period, start))
+    if emptied:
+        db.session.execute(db.delete(model).filter(
+            db.tuple_(owner, model.period, model.period_start).in_(emptied)))
+    write_rollups(model, owner_column, totals)
+
+
+def archive_batch(after_id, cutoff, batch_size):
+    """Archive the scores older than `cutoff` among the next `batch_size` scores.
+
+    Returns (last score id read or None at the end, number archived).
+    """
+    rows = db.session.execute(db.select(*(getattr(Score, name) for name in SCORE_COLUMNS))
+                              .filter(Score.score_id > after_id)
+                              .order_by(Score.score_id).limit(batch_size)).all()
+    if not rows:
+        return None, 0
+    old = [row for row in rows
+           if row.time_stamp_of_attempt is not None and row.time_stamp_of_attempt < cutoff]
+    if old:
+        user_totals = {}
+        quiz_totals = {}
+        for row in old:
+            score = row.total_score or 0
+            for period, start in periods(row.time_stamp_of_attempt):
+                for totals, owner_id in ((user_totals, row.user_id), (quiz_totals, row.quiz_id)):
+                    total = totals.setdefault((owner_id, period, start), [0, 0, score, Counter()])
+                    total[0] += 1
+                    total[1] += score
+                    total[2] = max(total[2], score)
+                    total[3][score] += 1
+        db.session.execute(db.insert(ScoreArchive), [row._asdict() for row in old])
+        add_rollups(UserScoreRollup, "user_id", {key: total for key, total in user_totals.items()
+                                                  if key[0] is not None})
+        add_rollups(QuizScoreRollup, "quiz_id", {key: total for key, total in quiz_totals.items()
+                                                  if key[0] is not None})
+        score_ids = [row.score_id for row in old]
+        db.session.execute(db.insert(AnswerSheetArchive).from_select(
+            SHEET_COLUMNS, db.select(*(getattr(AnswerSheet, name) for name in SHEET_COLUMNS))
+            .filter(AnswerSheet.score_id.in_(score_ids))))
+        db.session.execute(db.delete(AnswerSheet).filter(AnswerSheet.score_id.in_(score_ids)))
+        db.session.execute(db.delete(Score).filter(Score.score_id.in_(score_ids)))
+        db.session.commit()
+    # scores arrive in time order, a batch with nothing to archive means the rest is newer
+    return (rows[-1].score_id if old else None), len(old)
+
+
+def archive_scores(cutoff, batch_size):
+    after_id = 0
+    archived = 0
+    while after_id is not None:
+        after_id, count = archive_batch(after_id, cutoff, batch_size)
+        archived += count
+    return archived
+
+
+@app.cli.command("archive-scores")
+@click.option("--older-than-days", type=int, default=None,
+              help="Archive scores older than this, default SCORE_ARCHIVE_DAYS.")
+@click.option("--batch-size", type=int, default=None,
+              help="Scores read per transaction, default ARCHIVE_BATCH_SIZE.")
+def archive_scores_command(older_than_days, batch_size):
+    """Move old scores to the archive table and add them to the daily and weekly rollups."""
+    days = older_than_days if older_than_days is not None else app.config['SCORE_ARCHIVE_DAYS']
+    cutoff = datetime.combine(datetime.now().date() - timedelta(days=days), time())
+    archived = archive_scores(cutoff, batch_size or app.config['ARCHIVE_BATCH_SIZE'])
+    print(f"Archived {archived} scores older than {cutoff.date()}.")
+
+
+# ------------ Reading archived history ------------
+
+def user_weeks(user_id):
+    """Weekly totals of a user's archived scores, newest first."""
+    return db.session.execute(
+        db.select(UserScoreRollup.period_start, UserScoreRollup.attempts,
+                  UserScoreRollup.score_sum, UserScoreRollup.max_score)
+        .filter_by(user_id=user_id, period="week")
+        .order_by(UserScoreRollup.period_start.desc())).all()
+
+
+def user_daily_means(user_id):
+    # (noon of the day, mean score) of every day with archived scores, oldest first
+    rows = db.session.execute(
+        db.select(UserScoreRollup.period_start, UserScoreRollup.attempts, UserScoreRollup.score_sum)
+        .filter_by(user_id=user_id, period="day")
+        .order_by(UserScoreRollup.period_start)).all()
+    return [(datetime.combine(day, time(12)), score_sum / attempts)
+            for day, attempts, score_sum in rows]
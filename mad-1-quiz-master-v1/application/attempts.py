@@ -0,0 +1,226 @@
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+from app import app
+from application.models import db, Attempt
+
+
+# ------------ Timed quiz attempts ------------
+
+OPTIONS = {"1", "2", "3", "4"}
+
+
+def form_answers(form):
+    # answer fields are named after the question id, anything but an option is dropped
+    return {key: value for key, value in form.items() if key.isdigit() and value in OPTIONS}
+
+
+def start_attempt(user_id, quiz_id, duration):
+    # opening the quiz again resumes the open attempt with its deadline and answers,
+    # a new attempt is only started when there is none or the last one has run out
+    attempt = get_attempt(user_id, quiz_id)
+    if attempt and is_open(attempt):
+        autosaves.ensure_started()
+        return attempt
+    if not attempt:
+        attempt = Attempt(user_id=user_id, quiz_id=quiz_id)
+        db.session.add(attempt)
+    attempt.started_at = datetime.now()
+    attempt.deadline = attempt.started_at + timedelta(minutes=duration)
+    attempt.answers = '{}'
+    db.session.commit()
+    autosaves.register(attempt)
+    autosaves.ensure_started()
+    return attempt
+
+
+def get_attempt(user_id, quiz_id):
+    return db.session.execute(
+        db.select(Attempt).filter_by(user_id=user_id, quiz_id=quiz_id)).scalar_one_or_none()
+
+
+def is_open(attempt, now=None):
+    # answers are accepted until the deadline plus a grace period for slow networks
+    grace = timedelta(seconds=app.config['ATTEMPT_GRACE_SECONDS'])
+    return (now or datetime.now()) <= attempt.deadline + grace
+
+
+def load_answers(attempt):
+    return json.loads(attempt.answers) if attempt else {}
+
+
+def saved_answers(attempt):
+    # what a reopened quiz page shows, including autosaves this process has not written yet
+    autosaves.flush_attempt(attempt.attempt_id)
+    db.session.refresh(attempt)
+    return load_answers(attempt)
+
+
+def patch_answers(deltas):
+    # {attempt_id: answers} merged with json_patch in SQL, so writers of the same
+    # attempt never overwrite each other's answers with a stale copy
+    table = Attempt.__table__
+    db.session.execute(
+        db.update(table).where(table.c.attempt_id == db.bindparam("id"))
+        .values(answers=db.func.json_patch(table.c.answers, db.bindparam("delta"))),
+        [dict(id=attempt_id, delta=json.dumps(answers)) for attempt_id, answers in deltas.items()])
+
+
+def save_answers(attempt, form):
+    answers = form_answers(form)
+    if answers:
+        patch_answers({attempt.attempt_id: answers})
+        db.session.commit()
+
+
+def collect_answers(attempt, final_answers):
+    """Return every answer the attempt collected, merged with the final form.
+
+    Autosaved answers still buffered in this process are written first; the final
+    form is ignored once the attempt is past its deadline. The attempt itself is
+    deleted together with the score, see group_commit.save_score().
+    """
+    autosaves.flush_attempt(attempt.attempt_id)
+    db.session.refresh(attempt)
+    answers = load_answers(attempt)
+    if is_open(attempt):
+        answers.update(final_answers)
+    return answers
+
+
+# ------------ Autosave buffer ------------
+
+class AutosaveBuffer:
+    """Collects answer deltas in memory and writes them in one transaction per interval.
+
+    A background thread flushes the buffer every AUTOSAVE_FLUSH_SECONDS and
+    deletes attempts abandoned for longer than ATTEMPT_TTL_SECONDS.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        # deltas being written right now, still visible to take()
+        self.flushing = {}
+        # attempt_id -> (user_id, deadline) so autosaves skip the database
+        self.owners = {}
+        # one writer at a time, so an older delta is never written after a newer one
+        self.write_lock = threading.Lock()
+        self.thread = None
+        self.last_sweep = time.monotonic()
+
+    def ensure_started(self):
+        # started on first use, so under a pre-fork server each worker gets its own thread
+        with self.lock:
+            if not (self.thread and self.thread.is_alive()):
+                self.thread = threading.Thread(target=self.run, name="autosave", daemon=True)
+                self.thread.start()
+
+    def owner(self, attempt_id):
+        with self.lock:
+            owner = self.owners.get(attempt_id)
+        if owner is None:
+            # the attempt may have been started through another worker process
+            attempt = db.session.get(Attempt, attempt_id)
+            if not attempt:
+                return None
+            owner = (attempt.user_id, attempt.deadline)
+            with self.lock:
+                self.owners[attempt_id] = owner
+        return owner
+
+    def add(self, attempt_id, answers):
+        with self.lock:
+            self.pending.setdefault(attempt_id, {}).update(answers)
+
+    def take(self, attempt_id):
+        with self.lock:
+            answers = dict(self.flushing.get(attempt_id, {}))
+            answers.update(self.pending.pop(attempt_id, {}))
+            self.owners.pop(attempt_id, None)
+        return answers
+
+    def register(self, attempt):
+        with self.lock:
+            self.pending.pop(attempt.attempt_id, None)
+            self.owners[attempt.attempt_id] = (attempt.user_id, attempt.deadline)
+
+    def discard(self, attempt_id):
+        with self.lock:
+            self.pending.pop(attempt_id, None)
+            self.owners.pop(attempt_id, None)
+
+    def run(self):
+        while True:
+            time.sleep(app.config['AUTOSAVE_FLUSH_SECONDS'])
+            with app.app_context():
+                try:
+                    self.flush()
+                    if time.monotonic() - self.last_sweep >= app.config['ATTEMPT_SWEEP_SECONDS']:
+                        self.last_sweep = time.monotonic()
+                        self.sweep()
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception("Autosave flush failed")
+
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                self.flushing, self.pending = self.pending, {}
+            if not self.flushing:
+                return
+
+            try:
+                # attempts deleted in the meantime are simply not updated
+                patch_answers(self.flushing)
+                db.session.commit()
+            except Exception:
+                # put the deltas back for the next round, newer ones win
+                with self.lock:
+                    for attempt_id, answers in self.flushing.items():
+                        self.pending[attempt_id] = {**answers, **self.pending.get(attempt_id, {})}
+                raise
+            finally:
+                with self.lock:
+                    self.flushing = {}
+
+    def flush_attempt(self, attempt_id):
+        # writes one attempt's deltas right away, before it is graded
+        with self.write_lock:
+            answers = self.take(attempt_id)
+            if not answers:
+                return
+            try:
+                patch_answers({attempt_id: answers})
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                with self.lock:
+                    self.pending[attempt_id] = {**answers, **self.pending.get(attempt_id, {})}
+                raise
+
+    def sweep(self):
+        cutoff = datetime.now() - timedelta(seconds=app.config['ATTEMPT_TTL_SECONDS'])
+        expired = db.session.execute(
+            db.select(Attempt.attempt_id).filter(Attempt.deadline < cutoff)).scalars().all()
+        if expired:
+            db.session.execute(db.delete(Attempt).filter(Attempt.attempt_id.in_(expired)))
+            db.session.commit()
+            for attempt_id in expired:
+                self.discard(attempt_id)
+
+
+autosaves = AutosaveBuffer()
+
+
+def autosave(user_id, attempt_id, answers):
+    """Buffer answer deltas of an open attempt, returns False when it is not accepted."""
+    owner = autosaves.owner(attempt_id)
+    if owner is None or owner[0] != user_id or datetime.now() > owner[1] + timedelta(
+            seconds=app.config['ATTEMPT_GRACE_SECONDS']):
+        return False
+    autosaves.ensure_started()
+    autosaves.add(attempt_id, answers)
+    return True
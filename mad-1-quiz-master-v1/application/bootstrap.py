@@ -0,0 +1,81 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import click
+from werkzeug.security import generate_password_hash
+
+from app import app
+from application.models import db, User
+from application import catalog, search
+
+
+# ------------ One-time database setup ------------
+
+def init_db():
+    """Create whatever the database lacks. Safe to run again on an existing database."""
+    db.create_all()
+    # create_all skips tables that already exist, so add any index an older database lacks
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    # if admin exists, else create admin
+    admin = User.query.filter_by(is_admin=True).first()
+    if not admin:
+        password_hash = generate_password_hash('admin', app.config['PASSWORD_HASH_METHOD'])
+        admin = User(username='admin', passhash=password_hash, name='Admin', is_admin=True)
+        db.session.add(admin)
+        db.session.commit()
+    catalog.ensure_version_row()
+    search.ensure_search_index()
+
+
+@app.cli.command("init-db")
+def init_db_command():
+    """Create the tables, indexes, search index and admin user that are missing."""
+    init_db()
+    print("Database is ready.")
+
+
+# ------------ Cold start timing ------------
+
+# run in a fresh interpreter, so nothing is imported or connected beforehand
+STARTUP_PROBE = """
+import json, time
+started = time.perf_counter()
+from app import create_app
+app = create_app()
+created = time.perf_counter()
+client = app.test_client()
+client.get("/")
+first = time.perf_counter()
+client.post("/", data={"username": "startup-probe", "password": "x"})
+database = time.perf_counter()
+print(json.dumps(dict(create_app=created - started, first_response=first - started,
+                      first_database_response=database - started)))
+"""
+
+
+def measure_startup():
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", STARTUP_PROBE], cwd=app.root_path,
+                            env=os.environ, capture_output=True, text=True, check=True).stdout
+    timings = json.loads(output.strip().splitlines()[-1])
+    timings["process"] = time.perf_counter() - started
+    return timings
+
+
+@app.cli.command("measure-startup", with_appcontext=False)
+@click.option("--runs", default=5, show_default=True)
+def measure_startup_command(runs):
+    """Time fresh processes from interpreter start to their first responses."""
+    results = [measure_startup() for _ in range(runs)]
+    print(f"Median of {runs} cold starts:")
+    for name, label in [("create_app", "import and create_app()"),
+                        ("first_response", "first response (login page)"),
+                        ("first_database_response", "first response using the database"),
+                        ("process", "whole process, interpreter start to exit")]:
+        print(f"  {label:42} {statistics.median(r[name] for r in results) * 1000:8.1f} ms")
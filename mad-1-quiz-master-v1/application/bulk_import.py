@@ -0,0 +1,241 @@
+import csv
+import json
+from datetime import datetime
+
+import click
+
+from app import app
+from application.models import db, Subject, Chapter, Quiz, Question
+from application import answer_key, catalog
+
+
+# ------------ Bulk question import ------------
+
+# rows per executemany, and batches per transaction
+BATCH_SIZE = 2000
+BATCHES_PER_COMMIT = 10
+# only the first errors are kept so a broken file cannot exhaust memory
+MAX_REPORTED_ERRORS = 500
+
+FIELDS = ["subject", "chapter", "quiz_date", "quiz_duration", "question",
+          "option1", "option2", "option3", "option4", "correct_option"]
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+class DecodedLines:
+    """Decodes a binary stream as UTF-8 one line at a time.
+
+    A line that is not UTF-8 is decoded with replacement characters and its number
+    remembered, so the record on it is reported instead of failing the whole file.
+    """
+
+    def __init__(self, binary):
+        self.binary = binary
+        self.invalid = set()
+
+    def __iter__(self):
+        for line_number, line in enumerate(self.binary, start=1):
+            try:
+                yield line.decode("utf-8-sig" if line_number == 1 else "utf-8")
+            except UnicodeDecodeError:
+                self.invalid.add(line_number)
+                yield line.decode("utf-8", errors="replace")
+
+    def any_invalid(self, first, last):
+        return any(first <= line_number <= last for line_number in self.invalid)
+
+
+def read_records(lines, file_format, report):
+    # yields (line number, record dict) one at a time from DecodedLines, unreadable
+    # records are reported and skipped
+    if file_format == "csv":
+        reader = csv.DictReader(lines)
+        try:
+            # reads the header row
+            reader.fieldnames
+        except csv.Error as error:
+            report.error(1, f"not valid CSV: {error}")
+            return
+        last_line = reader.line_num
+        while True:
+            first_line = last_line + 1
+            try:
+                record = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as error:
+                report.error(max(reader.line_num, first_line), f"not valid CSV: {error}")
+                continue
+            finally:
+                last_line = reader.line_num
+            # a quoted field may span several lines
+            if lines.any_invalid(first_line, last_line):
+                report.error(last_line, "not valid UTF-8")
+                continue
+            yield last_line, record
+    else:
+        for line_number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            if line_number in lines.invalid:
+                report.error(line_number, "not valid UTF-8")
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield line_number, None
+                continue
+            yield line_number, record if isinstance(record, dict) else None
+
+
+def validate(record):
+    # returns the cleaned row, raises ValueError with a readable message otherwise
+    if record is None:
+        raise ValueError("not a valid record")
+
+    row = {}
+    for field in FIELDS:
+        value = record.get(field)
+        value = str(value).strip() if value is not None else ""
+        if not value:
+            raise ValueError(f"{field} is required")
+        row[field] = value
+
+    try:
+        row["correct_option"] = int(row["correct_option"])
+    except ValueError:
+        raise ValueError("correct_option should be an integer")
+    if not 1 <= row["correct_option"] <= 4:
+        raise ValueError("correct_option should be between 1 and 4")
+
+    try:
+        row["quiz_date"] = datetime.strptime(row["quiz_date"], "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError("quiz_date should be in YYYY-MM-DD format")
+    try:
+        row["quiz_duration"] = int(row["quiz_duration"])
+    except ValueError:
+        raise ValueError("quiz_duration should be an integer")
+
+    for field in ("subject_description", "chapter_description"):
+        row[field] = str(record.get(field) or "").strip()
+    return row
+
+
+class CatalogResolver:
+    # maps names to ids, creating subjects, chapters and quizzes the first time they are seen
+    def __init__(self):
+        self.subjects = dict(db.session.execute(db.select(Subject.name, Subject.subject_id)).all())
+        self.chapters = {name: (chapter_id, subject_id) for name, chapter_id, subject_id in
+                         db.session.execute(db.select(Chapter.name, Chapter.chapter_id,
+                                                      Chapter.subject_id)).all()}
+        self.quizzes = {}
+
+    def subject_id(self, row):
+        if row["subject"] not in self.subjects:
+            subject = Subject(name=row["subject"], description=row["subject_description"])
+            db.session.add(subject)
+            db.session.flush()
+            self.subjects[subject.name] = subject.subject_id
+        return self.subjects[row["subject"]]
+
+    def chapter_id(self, row):
+        if row["chapter"] in self.chapters:
+            chapter_id, subject_id = self.chapters[row["chapter"]]
+            # chapter names are unique across subjects, checked before a subject is created
+            if self.subjects.get(row["subject"]) != subject_id:
+                raise ValueError(f"chapter {row['chapter']} belongs to another subject")
+            return chapter_id
+
+        subject_id = self.subject_id(row)
+        chapter = Chapter(name=row["chapter"], description=row["chapter_description"],
+                          subject_id=subject_id)
+        db.session.add(chapter)
+        db.session.flush()
+        self.chapters[chapter.name] = (chapter.chapter_id, subject_id)
+        return chapter.chapter_id
+
+    def quiz_id(self, row):
+        # a quiz is identified by its chapter, date and duration
+        key = (self.chapter_id(row), row["quiz_date"], row["quiz_duration"])
+        if key not in self.quizzes:
+            quiz_id = db.session.scalar(db.select(Quiz.quiz_id).filter_by(
+                chapter_id=key[0], date_of_quiz=key[1], time_duration=key[2]).limit(1))
+            if quiz_id is None:
+                quiz = Quiz(chapter_id=key[0], date_of_quiz=key[1], time_duration=key[2])
+                db.session.add(quiz)
+                db.session.flush()
+                quiz_id = quiz.quiz_id
+            self.quizzes[key] = quiz_id
+        return self.quizzes[key]
+
+
+def import_questions(lines, file_format):
+    report = ImportReport()
+    resolver = CatalogResolver()
+    batch = []
+    batches = 0
+
+    def flush():
+        nonlocal batch, batches
+        if batch:
+            db.session.execute(db.insert(Question), batch)
+            report.imported += len(batch)
+            batch = []
+            batches += 1
+            if batches % BATCHES_PER_COMMIT == 0:
+                db.session.commit()
+
+    for line, record in read_records(lines, file_format, report):
+        try:
+            row = validate(record)
+            quiz_id = resolver.quiz_id(row)
+        except ValueError as error:
+            report.error(line, str(error))
+            continue
+
+        batch.append(dict(quiz_id=quiz_id, question_statement=row["question"],
+                          option1=row["option1"], option2=row["option2"],
+                          option3=row["option3"], option4=row["option4"],
+                          correct_option=row["correct_option"]))
+        if len(batch) >= BATCH_SIZE:
+            flush()
+
+    flush()
+    catalog.bump_version()
+    db.session.commit()
+    answer_key.invalidate()
+    return report
+
+
+def file_format_for(filename):
+    return "csv" if filename.lower().endswith(".csv") else "jsonl"
+
+
+def import_upload(file_storage):
+    return import_questions(DecodedLines(file_storage.stream), file_format_for(file_storage.filename))
+
+
+@app.cli.command("import-questions")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "file_format", type=click.Choice(["csv", "jsonl"]),
+              help="Defaults to csv for .csv files and jsonl otherwise.")
+def import_questions_command(path, file_format):
+    """Import questions from a CSV or JSON-lines file."""
+    with open(path, "rb") as stream:
+        report = import_questions(DecodedLines(stream), file_format or file_format_for(path))
+
+    print(f"Imported {report.imported} questions, {report.failed} rows failed.")
+    for line, message in report.errors:
+        print(f"line {line}: {message}")
@@ -0,0 +1,185 @@
+from threading import Lock
+from types import MappingProxyType
+
+from flask import g
+
+from app import app
+from application.models import db, Subject, Chapter, Quiz, Question, CatalogVersion
+
+
+# ------------ Read-only catalog snapshot ------------
+
+# Records mirror the attribute names of the models, so templates render either.
+
+class SubjectRecord:
+    __slots__ = ("subject_id", "name", "description", "chapters")
+
+
+class ChapterRecord:
+    __slots__ = ("chapter_id", "subject_id", "name", "description", "subject", "quizzes")
+
+
+class QuizRecord:
+    __slots__ = ("quiz_id", "chapter_id", "date_of_quiz", "time_duration", "remarks",
+                 "chapter", "questions", "question_count")
+
+
+class QuestionRecord:
+    __slots__ = ("question_id", "quiz_id", "question_statement", "quiz")
+
+
+class Catalog:
+    """Immutable Subject -> Chapter -> Quiz -> Question tree as of one catalog version."""
+
+    def __init__(self, version, subjects, chapters, quizzes, questions):
+        self.version = version
+        self.subjects = subjects
+        self.quizzes = quizzes
+        self.subjects_by_id = MappingProxyType({s.subject_id: s for s in subjects})
+        self.chapters_by_id = MappingProxyType({c.chapter_id: c for c in chapters})
+        self.quizzes_by_id = MappingProxyType({q.quiz_id: q for q in quizzes})
+        self.questions_by_id = MappingProxyType({q.question_id: q for q in questions})
+
+
+def record(cls, **values):
+    item = cls()
+    for name, value in values.items():
+        setattr(item, name, value)
+    return item
+
+
+def load_catalog(version):
+    # four flat queries, the tree is linked up in memory
+    subjects = [record(SubjectRecord, subject_id=row.subject_id, name=row.name,
+                       description=row.description, chapters=[])
+                for row in db.session.execute(db.select(Subject.subject_id, Subject.name,
+                                                        Subject.description)
+                                              .order_by(Subject.subject_id))]
+    subjects_by_id = {s.subject_id: s for s in subjects}
+
+    chapters = []
+    for row in db.session.execute(db.select(Chapter.chapter_id, Chapter.subject_id, Chapter.name,
+                                            Chapter.description).order_by(Chapter.chapter_id)):
+        subject = subjects_by_id.get(row.subject_id)
+        chapter = record(ChapterRecord, chapter_id=row.chapter_id, subject_id=row.subject_id,
+                         name=row.name, description=row.description, subject=subject, quizzes=[])
+        if subject:
+            subject.chapters.append(chapter)
+        chapters.append(chapter)
+    chapters_by_id = {c.chapter_id: c for c in chapters}
+
+    quizzes = []
+    for row in db.session.execute(db.select(Quiz.quiz_id, Quiz.chapter_id, Quiz.date_of_quiz,
+                                            Quiz.time_duration, Quiz.remarks)
+                                  .order_by(Quiz.quiz_id)):
+        chapter = chapters_by_id.get(row.chapter_id)
+        quiz = record(QuizRecord, quiz_id=row.quiz_id, chapter_id=row.chapter_id,
+                      date_of_quiz=row.date_of_quiz, time_duration=row.time_duration,
+                      remarks=row.remarks, chapter=chapter, questions=[])
+        if chapter:
+            chapter.quizzes.append(quiz)
+        quizzes.append(quiz)
+    quizzes_by_id = {q.quiz_id: q for q in quizzes}
+
+    questions = []
+    for row in db.session.execute(db.select(Question.question_id, Question.quiz_id,
+                                            Question.question_statement)
+                                  .order_by(Question.question_id)):
+        quiz = quizzes_by_id.get(row.quiz_id)
+        question = record(QuestionRecord, question_id=row.question_id, quiz_id=row.quiz_id,
+                          question_statement=row.question_statement, quiz=quiz)
+        if quiz:
+            quiz.questions.append(question)
+        questions.append(question)
+
+    # freeze the child lists once everything is linked
+    for subject in subjects:
+        subject.chapters = tuple(subject.chapters)
+    for chapter in chapters:
+        chapter.quizzes = tuple(chapter.quizzes)
+    for quiz in quizzes:
+        quiz.questions = tuple(quiz.questions)
+        quiz.question_count = len(quiz.questions)
+
+    return Catalog(version, tuple(subjects), chapters, tuple(quizzes), questions)
+
+
+# ------------ Catalog version ------------
+
+def current_version():
+    # one primary key read, done at most once per request
+    if "catalog_version" not in g:
+        g.catalog_version = db.session.scalar(db.select(CatalogVersion.version)
+                                              .filter_by(id=1)) or 0
+    return g.catalog_version
+
+
+def bump_version():
+    # call before the commit of any change to subjects, chapters, quizzes or questions,
+    # so the new version is committed together with the change
+    db.session.execute(db.update(CatalogVersion).filter_by(id=1)
+                       .values(version=CatalogVersion.version + 1))
+    g.pop("catalog_version", None)
+
+
+def ensure_version_row():
+    if not db.session.get(CatalogVersion, 1):
+        db.session.add(CatalogVersion(id=1, version=0))
+        db.session.commit()
+
+
+_catalog = None
+_lock = Lock()
+
+
+def get_catalog():
+    """Return the snapshot for the current catalog version, rebuilding it when it is stale."""
+    global _catalog
+    version = current_version()
+    catalog = _catalog
+    if catalog is not None and catalog.version == version:
+        return catalog
+
+    with _lock:
+        # another thread may have rebuilt it while this one waited
+        if _catalog is None or _catalog.version != version:
+            _catalog = load_catalog(version)
+        return _catalog
+
+
+def quiz_metadata(quiz_id):
+    """Return quiz, chapter, subject and question count of one quiz as a dict, or None.
+
+    Read from the snapshot when it is current, otherwise with one aggregate query
+    instead of rebuilding the whole snapshot for a single quiz.
+    """
+    catalog = _catalog
+    if catalog is not None and catalog.version == current_version():
+        quiz = catalog.quizzes_by_id.get(quiz_id)
+        if not quiz:
+            return None
+        chapter = quiz.chapter
+        subject = chapter.subject if chapter else None
+        return dict(quiz_id=quiz.quiz_id, date_of_quiz=quiz.date_of_quiz,
+                    time_duration=quiz.time_duration, remarks=quiz.remarks,
+                    chapter_id=quiz.chapter_id, chapter=chapter.name if chapter else None,
+                    subject_id=chapter.subject_id if chapter else None,
+                    subject=subject.name if subject else None,
+                    question_count=quiz.question_count)
+
+    question_count = (db.select(db.func.count()).select_from(Question)
+                      .filter(Question.quiz_id == Quiz.quiz_id).scalar_subquery())
+    row = db.session.execute(
+        db.select(Quiz.quiz_id, Quiz.date_of_quiz, Quiz.time_duration, Quiz.remarks,
+                  Quiz.chapter_id, Chapter.name.label("chapter"), Chapter.subject_id,
+                  Subject.name.label("subject"), question_count.label("question_count"))
+        .outerjoin(Chapter, Chapter.chapter_id == Quiz.chapter_id)
+        .outerjoin(Subject, Subject.subject_id == Chapter.subject_id)
+        .filter(Quiz.quiz_id == quiz_id)
+    ).first()
+    return row._asdict() if row else None
+
+
+@app.teardown_request
+def forget_catalog_version(exc):
+    g.pop("catalog_version", None)
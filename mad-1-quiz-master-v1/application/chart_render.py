@@ -0,0 +1,58 @@
+import glob
+import os
+
+
+# ------------ Chart drawing, runs in the chart worker processes ------------
+
+# This module must not import the app: the worker processes are spawned fresh and only
+# import what the functions below need, so they do not open database connections.
+
+def draw_score_history(axes, data):
+    from matplotlib.dates import AutoDateLocator, ConciseDateFormatter
+
+    axes.plot(data["times"], data["scores"], marker="o", linewidth=1)
+    locator = AutoDateLocator()
+    axes.xaxis.set_major_locator(locator)
+    axes.xaxis.set_major_formatter(ConciseDateFormatter(locator))
+    axes.set_ylim(0, 100)
+    axes.set_xlabel("Date")
+    axes.set_ylabel("Score (%)")
+    axes.set_title("Scores over time")
+    axes.grid(alpha=0.3)
+
+
+def draw_score_distribution(axes, data):
+    axes.bar(data["scores"], data["counts"], width=1.0)
+    axes.set_xlim(-1, 101)
+    axes.set_xlabel("Score (%)")
+    axes.set_ylabel("Attempts")
+    axes.set_title("Score distribution")
+    axes.grid(axis="y", alpha=0.3)
+
+
+DRAW = {"user": draw_score_history, "quiz": draw_score_distribution}
+
+
+def render(kind, data, path, prefix):
+    """Draw one chart to path, replacing the other files starting with prefix, its older versions."""
+    # imported here so neither the web process nor its startup pays for matplotlib
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(6, 3), dpi=100, layout="tight")
+    DRAW[kind](figure.add_subplot(), data)
+
+    # write to a temporary file first so a request never serves a half written chart
+    temporary = f"{path}.{os.getpid()}.tmp"
+    figure.savefig(temporary, format=os.path.splitext(path)[1][1:])
+    os.replace(temporary, path)
+
+    extension = os.path.splitext(path)[1]
+    for old in glob.glob(f"{glob.escape(prefix)}*{extension}"):
+        if old != path:
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                pass
+    return path
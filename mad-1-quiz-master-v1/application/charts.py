@@ -0,0 +1,133 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+
+from app import app
+from application.models import db, Score, ScoreArchive, UserScoreRollup, QuizScoreBucket
+from application import archive, chart_render, stats
+
+
+# ------------ Score charts ------------
+
+# Charts are drawn by a small pool of worker processes and cached on disk as
+# <kind>-<id>-<data version>.<format>. The data version combines the number of scores
+# behind the chart, the newest of their ids, hot or archived, and for users the number
+# archived into daily rollups, so a chart is redrawn only after scores arrive, are
+# deleted or archived. Its parts are joined with "_" so the files of user 5 start with
+# "user-5-" and never with "user-50-".
+
+PLACEHOLDER = """<svg xmlns="http://www.w3.org/2000/svg" width="600" height="300">
+<rect width="100%" height="100%" fill="#f8f9fa"/>
+<text x="50%" y="50%" text-anchor="middle" font-family="sans-serif" font-size="16"
+fill="#6c757d">Drawing chart...</text></svg>"""
+
+MIMETYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+
+def data_version(kind, obj_id):
+    # the count alone could come back to an earlier value after deletes. Score ids are
+    # never reused (group_commit.allocate_score_ids), so new scores always raise the
+    # newest id and a count with the same newest id can only mean the same scores
+    owner = "user_id" if kind == "user" else "quiz_id"
+    newest = db.func.max(*(
+        db.func.coalesce(db.select(db.func.max(model.score_id))
+                         .filter_by(**{owner: obj_id}).scalar_subquery(), 0)
+        for model in (Score, ScoreArchive)))
+    if kind == "user":
+        # archiving moves scores into the daily rollups the chart draws as one point
+        archived = (db.select(db.func.coalesce(db.func.sum(UserScoreRollup.attempts), 0))
+                    .filter_by(user_id=obj_id, period="day").scalar_subquery())
+        hot = db.select(db.func.count(Score.score_id)).filter_by(user_id=obj_id).scalar_subquery()
+        row = db.session.execute(db.select(hot, newest, archived)).one()
+    else:
+        counted = (db.select(db.func.coalesce(db.func.sum(QuizScoreBucket.count), 0))
+                   .filter_by(quiz_id=obj_id).scalar_subquery())
+        row = db.session.execute(db.select(counted, newest)).one()
+    return "_".join(str(value or 0) for value in row)
+
+
+def chart_data(kind, obj_id):
+    # plain lists, they are pickled to the worker process
+    if kind == "user":
+        # archived scores are drawn as one point per day, their daily mean
+        rows = archive.user_daily_means(obj_id) + db.session.execute(
+            db.select(Score.time_stamp_of_attempt, Score.total_score)
+            .filter_by(user_id=obj_id).order_by(Score.time_stamp_of_attempt)
+        ).all()
+        return dict(times=[row[0] for row in rows], scores=[row[1] for row in rows])
+    histogram = stats.get_quiz_histogram(obj_id)
+    return dict(scores=list(histogram), counts=list(histogram.values()))
+
+
+class ChartRenderer:
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pool = None
+        self.pending = {}
+        self.lock = Lock()
+
+    def get_pool(self):
+        # created on first use so startup does not pay for it; spawned workers do not
+        # inherit the database connections or threads of the web process
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return self.pool
+
+    def request(self, kind, obj_id, version, path):
+        """Queue a chart unless it is already queued or too many charts are pending."""
+        key = (kind, obj_id, version)
+        with self.lock:
+            if key in self.pending or len(self.pending) >= self.max_pending:
+                return
+            # claimed before the data is read, so concurrent requests do not queue it twice
+            self.pending[key] = None
+
+        try:
+            data = chart_data(kind, obj_id)
+            with self.lock:
+                future = self.pending[key] = self.get_pool().submit(
+                    chart_render.render, kind, data, path, chart_prefix(kind, obj_id))
+        except Exception:
+            with self.lock:
+                self.pending.pop(key, None)
+            raise
+        future.add_done_callback(lambda done: self.finished(key, done))
+
+    def shutdown(self):
+        # waits for the queued charts; needed where atexit does not run, e.g. in a pool worker
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def finished(self, key, future):
+        with self.lock:
+            self.pending.pop(key, None)
+        if future.exception() is not None:
+            app.logger.error("Chart %s failed: %s", key, future.exception())
+
+
+renderer = ChartRenderer(workers=app.config['CHART_WORKERS'],
+                         max_pending=app.config['CHART_MAX_PENDING'])
+
+
+def chart_prefix(kind, obj_id):
+    return os.path.join(app.config['CHART_CACHE_DIR'], f"{kind}-{obj_id}-")
+
+
+def chart_path(kind, obj_id, version):
+    return f"{chart_prefix(kind, obj_id)}{version}.{app.config['CHART_FORMAT']}"
+
+
+def get_chart(kind, obj_id):
+    """Return (path, version) of a chart that is ready, or (None, version) while it is drawn."""
+    version = data_version(kind, obj_id)
+    path = chart_path(kind, obj_id, version)
+    if os.path.exists(path):
+        return path, version
+    os.makedirs(app.config['CHART_CACHE_DIR'], exist_ok=True)
+    renderer.request(kind, obj_id, version, path)
+    return None, version
@@ -7,4 +7,69 @@ from app import app
 
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLALCHEMY_DATABASE_URI')
-app.config['SQLALCHEMY_TRACK_MODIFICATION'] = os.getenv('SQLALCHEMY_TRACK_MODIFICATION')
\ No newline at end of file
+app.config['SQLALCHEMY_TRACK_MODIFICATION'] = os.getenv('SQLALCHEMY_TRACK_MODIFICATION')
+
+# "production" turns on WAL and the other SQLite pragmas in application/database.py
+app.config['DB_PROFILE'] = os.getenv('DB_PROFILE', 'development')
+app.config['SQLITE_BUSY_TIMEOUT'] = int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000))
+app.config['SQLITE_CACHE_SIZE'] = int(os.getenv('SQLITE_CACHE_SIZE', -64000))
+app.config['SQLITE_MMAP_SIZE'] = int(os.getenv('SQLITE_MMAP_SIZE', 268435456))
+
+# group commit of quiz submissions, see application/group_commit.py
+app.config['SCORE_GROUP_COMMIT'] = os.getenv('SCORE_GROUP_COMMIT', 'false').lower() == 'true'
+app.config['SCORE_BATCH_SIZE'] = int(os.getenv('SCORE_BATCH_SIZE', 200))
+app.config['SCORE_BATCH_DELAY_MS'] = int(os.getenv('SCORE_BATCH_DELAY_MS', 20))
+app.config['SCORE_QUEUE_SIZE'] = int(os.getenv('SCORE_QUEUE_SIZE', 5000))
+app.config['SCORE_COMMIT_TIMEOUT'] = int(os.getenv('SCORE_COMMIT_TIMEOUT', 10))
+
+# total characters of rendered quiz papers kept by application/paper_cache.py
+app.config['PAPER_CACHE_SIZE'] = int(os.getenv('PAPER_CACHE_SIZE', 32 * 1024 * 1024))
+
+# quizzes with more questions than this are served in pages of QUIZ_PAGE_SIZE questions
+app.config['LARGE_QUIZ_QUESTIONS'] = int(os.getenv('LARGE_QUIZ_QUESTIONS', 100))
+app.config['QUIZ_PAGE_SIZE'] = int(os.getenv('QUIZ_PAGE_SIZE', 25))
+
+# rows per page of the admin lists, search results and score history, see application/pagination.py
+app.config['LIST_PAGE_SIZE'] = int(os.getenv('LIST_PAGE_SIZE', 20))
+app.config['QUESTION_PAGE_SIZE'] = int(os.getenv('QUESTION_PAGE_SIZE', 50))
+
+# timed attempts, see application/attempts.py
+app.config['ATTEMPT_GRACE_SECONDS'] = int(os.getenv('ATTEMPT_GRACE_SECONDS', 30))
+app.config['ATTEMPT_TTL_SECONDS'] = int(os.getenv('ATTEMPT_TTL_SECONDS', 3600))
+app.config['AUTOSAVE_FLUSH_SECONDS'] = float(os.getenv('AUTOSAVE_FLUSH_SECONDS', 2))
+app.config['ATTEMPT_SWEEP_SECONDS'] = int(os.getenv('ATTEMPT_SWEEP_SECONDS', 60))
+
+# score charts, see application/charts.py
+app.config['CHART_CACHE_DIR'] = os.getenv('CHART_CACHE_DIR', os.path.join(app.instance_path, 'charts'))
+app.config['CHART_FORMAT'] = os.getenv('CHART_FORMAT', 'png').lower()
+app.config['CHART_WORKERS'] = int(os.getenv('CHART_WORKERS', 2))
+app.config['CHART_MAX_PENDING'] = int(os.getenv('CHART_MAX_PENDING', 64))
+
+# request instrumentation, see application/instrumentation.py
+app.config['METRICS_SAMPLE_RATE'] = float(os.getenv('METRICS_SAMPLE_RATE', 0.1))
+app.config['N_PLUS_ONE_THRESHOLD'] = int(os.getenv('N_PLUS_ONE_THRESHOLD', 5))
+# lets a Prometheus scraper read /metrics with "Authorization: Bearer <token>"
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+
+# password hashing, see application/passwords.py; hashes of another method are
+# upgraded on the next sign in
+app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'scrypt')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+app.config['PASSWORD_HASH_QUEUE'] = int(os.getenv('PASSWORD_HASH_QUEUE', 64))
+app.config['PASSWORD_HASH_TIMEOUT'] = int(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+
+# conditional GET and compression, see application/http_cache.py; brotli is used when
+# the brotli package is installed
+app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+app.config['COMPRESS_LEVEL'] = int(os.getenv('COMPRESS_LEVEL', 6))
+app.config['BROTLI_QUALITY'] = int(os.getenv('BROTLI_QUALITY', 5))
+
+# deletes of subjects, chapters and quizzes, see application/deletes.py; results of a
+# subtree with more than PURGE_THRESHOLD scores are purged in the background
+app.config['PURGE_THRESHOLD'] = int(os.getenv('PURGE_THRESHOLD', 10000))
+app.config['PURGE_CHUNK_SIZE'] = int(os.getenv('PURGE_CHUNK_SIZE', 2000))
+app.config['PURGE_PAUSE_MS'] = int(os.getenv('PURGE_PAUSE_MS', 50))
+
+# score archival, see application/archive.py
+app.config['SCORE_ARCHIVE_DAYS'] = int(os.getenv('SCORE_ARCHIVE_DAYS', 365))
+app.config['ARCHIVE_BATCH_SIZE'] = int(os.getenv('ARCHIVE_BATCH_SIZE', 5000))
@@ -3,4 +3,18 @@ from flask_sqlalchemy import SQLAlchemy
 
 engine = None
 Base = declarative_base()
-db = SQLAlchemy()
\ No newline at end of file
+db = SQLAlchemy()
+
+def set_sqlite_pragmas(app):
+    # applied to every new DBAPI connection; the WAL journal mode is persisted in the file
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA busy_timeout = {app.config['SQLITE_BUSY_TIMEOUT']}")
+        if app.config['DB_PROFILE'] == 'production':
+            cursor.execute("PRAGMA journal_mode = WAL")
+            cursor.execute("PRAGMA synchronous = NORMAL")
+            cursor.execute(f"PRAGMA cache_size = {app.config['SQLITE_CACHE_SIZE']}")
+            cursor.execute(f"PRAGMA mmap_size = {app.config['SQLITE_MMAP_SIZE']}")
+            cursor.execute("PRAGMA temp_store = MEMORY")
+        cursor.close()
+    return on_connect
@@ -0,0 +1,172 @@
+import threading
+import time
+from datetime import datetime
+
+from app import app
+from application.models import db, Subject, Chapter, Quiz, Question, Score, ScoreArchive, \
+    AnswerSheet, AnswerSheetArchive, Attempt, QuizScoreBucket, QuizScoreRollup, QuizAnalysis, ItemAnalysis, PendingPurge, \
+    UserScoreRollup
+from application import archive, stats
+
+
+# ------------ Set-based deletes ------------
+
+# A subject, chapter or quiz is deleted with one DELETE ... WHERE per table, children
+# first, instead of loading the subtree into the session and deleting it row by row.
+# When the subtree holds more than PURGE_THRESHOLD scores only the catalog rows are
+# deleted right away; the quizzes are queued in PendingPurge and their scores are purged
+# in small transactions by a background thread, so the write lock is held only briefly.
+# The user statistics are updated in the transaction that deletes the scores.
+
+# rows keyed by quiz id, children first; there are few of them except for scores
+SCORE_MODELS = (Score, ScoreArchive)
+SHEET_MODELS = {Score: AnswerSheet, ScoreArchive: AnswerSheetArchive}
+RESULT_MODELS = (*SHEET_MODELS.values(), *SCORE_MODELS, Attempt, QuizScoreBucket, QuizScoreRollup,
+                 QuizAnalysis, ItemAnalysis)
+
+
+def is_large(quiz_ids):
+    # counts no further than the threshold
+    limit = app.config['PURGE_THRESHOLD']
+    found = 0
+    for model in SCORE_MODELS:
+        found += db.session.scalar(db.select(db.func.count()).select_from(
+            db.select(model.score_id).filter(model.quiz_id.in_(quiz_ids)).limit(limit + 1).subquery()))
+    return found > limit
+
+
+def delete_tree(subject_id=None, chapter_id=None, quiz_id=None):
+    """Delete one subject, chapter or quiz with everything under it.
+
+    The caller bumps the catalog version and commits. Returns True when the scores
+    were queued for the background purge, start it with start_purge() after the commit.
+    """
+    if subject_id is not None:
+        chapter_ids = db.session.execute(
+            db.select(Chapter.chapter_id).filter_by(subject_id=subject_id)).scalars().all()
+    else:
+        chapter_ids = [chapter_id] if chapter_id is not None else []
+    if quiz_id is not None:
+        quiz_ids = [quiz_id]
+    else:
+        quiz_ids = db.session.execute(
+            db.select(Quiz.quiz_id).filter(Quiz.chapter_id.in_(chapter_ids))).scalars().all()
+
+    queued = is_large(quiz_ids)
+    if queued:
+        # sqlite may hand a deleted quiz id to the next new quiz, so scores are only
+        # purged up to the last one that exists now
+        last_score_id = max(db.session.scalar(db.select(db.func.max(model.score_id))) or 0
+                            for model in SCORE_MODELS)
+        now = datetime.now()
+        db.session.execute(db.insert(PendingPurge).prefix_with("OR REPLACE"),
+                           [dict(quiz_id=quiz, last_score_id=last_score_id, queued_at=now)
+                            for quiz in quiz_ids])
+        delete_results(quiz_ids, RESULT_MODELS[len(SHEET_MODELS) + len(SCORE_MODELS):])
+    elif quiz_ids:
+        delete_results(quiz_ids)
+
+    db.session.execute(db.delete(Question).filter(Question.quiz_id.in_(quiz_ids)))
+    db.session.execute(db.delete(Quiz).filter(Quiz.quiz_id.in_(quiz_ids)))
+    db.session.execute(db.delete(Chapter).filter(Chapter.chapter_id.in_(chapter_ids)))
+    if subject_id is not None:
+        db.session.execute(db.delete(Subject).filter_by(subject_id=subject_id))
+    return queued
+
+
+def delete_results(quiz_ids, models=RESULT_MODELS):
+    removed = []
+    for model in models:
+        if model in SCORE_MODELS:
+            rows = db.session.execute(
+                db.select(model.user_id, model.time_stamp_of_attempt, model.total_score)
+                .filter(model.quiz_id.in_(quiz_ids))).all()
+            forget_rollups(model, rows)
+            removed += rows
+        db.session.execute(db.delete(model).filter(model.quiz_id.in_(quiz_ids)))
+    stats.forget_scores([(user_id, score) for user_id, _, score in removed])
+
+
+def forget_rollups(model, rows):
+    # per quiz rollups go with the quiz, the per user ones of archived scores are kept exact
+    if model is ScoreArchive:
+        archive.remove_rollups(UserScoreRollup, "user_id", rows)
+
+
+# ------------ Background purge ------------
+
+def purge_chunk(limit):
+    """Delete up to `limit` hot or archived scores of queued quizzes in one transaction.
+
+    Returns the number of rows deleted, 0 once nothing is queued.
+    """
+    queued = db.session.execute(db.select(PendingPurge.quiz_id, PendingPurge.last_score_id)).all()
+    if not queued:
+        return 0
+    for model in SCORE_MODELS:
+        scores = db.or_(*(db.and_(model.quiz_id == quiz_id, model.score_id <= last_score_id)
+                          for quiz_id, last_score_id in queued))
+        rows = db.session.execute(db.select(model.score_id, model.user_id,
+                                            model.time_stamp_of_attempt, model.total_score)
+                                  .filter(scores).limit(limit)).all()
+        if rows:
+            break
+    if rows:
+        score_ids = [row.score_id for row in rows]
+        sheet = SHEET_MODELS[model]
+        db.session.execute(db.delete(sheet).filter(sheet.score_id.in_(score_ids)))
+        db.session.execute(db.delete(model).filter(model.score_id.in_(score_ids)))
+        forget_rollups(model, [(row.user_id, row.time_stamp_of_attempt, row.total_score)
+                               for row in rows])
+        stats.forget_scores([(row.user_id, row.total_score) for row in rows])
+        deleted = len(rows)
+    else:
+        db.session.execute(db.delete(PendingPurge).filter(
+            PendingPurge.quiz_id.in_([quiz_id for quiz_id, _ in queued])))
+        deleted = len(queued)
+    db.session.commit()
+    return deleted
+
+
+class Purger:
+    """Runs purge_chunk() on a background thread until the queue is empty."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def ensure_started(self):
+        # one thread per process, it ends when there is nothing left to purge
+        with self.lock:
+            if not (self.thread and self.thread.is_alive()):
+                self.thread = threading.Thread(target=self.run, name="purge", daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            with app.app_context():
+                try:
+                    if not purge_chunk(app.config['PURGE_CHUNK_SIZE']):
+                        return
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception("Purge of deleted quizzes failed")
+                    return
+            # lets quiz submissions take the write lock between chunks
+            time.sleep(app.config['PURGE_PAUSE_MS'] / 1000)
+
+
+purger = Purger()
+
+
+def start_purge():
+    purger.ensure_started()
+
+
+@app.cli.command("purge-deleted")
+def purge_deleted_command():
+    """Purge the scores of deleted quizzes left in the queue, e.g. after a restart."""
+    total = 0
+    while deleted := purge_chunk(app.config['PURGE_CHUNK_SIZE']):
+        total += deleted
+    print(f"Purged {total} rows.")
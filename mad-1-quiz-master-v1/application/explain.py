@@ -0,0 +1,81 @@
+from flask import url_for
+from sqlalchemy import event
+
+from app import app
+from application.models import db, User, Subject, Chapter, Quiz, Question
+
+
+# ------------ EXPLAIN QUERY PLAN for every page ------------
+
+def sample_route_args():
+    # the first row of each table fills the url parameters of the routes
+    return dict(
+        subject_id=db.session.scalar(db.select(Subject.subject_id).limit(1)),
+        chapter_id=db.session.scalar(db.select(Chapter.chapter_id).limit(1)),
+        quiz_id=db.session.scalar(db.select(Quiz.quiz_id).limit(1)),
+        question_id=db.session.scalar(db.select(Question.question_id).limit(1)),
+    )
+
+
+def explainable_routes():
+    # only pages that are safe to request, the delete routes also answer GET
+    for rule in app.url_map.iter_rules():
+        if "GET" not in rule.methods or rule.endpoint == "static":
+            continue
+        if rule.endpoint == "logout" or rule.endpoint.startswith("delete"):
+            continue
+        yield rule
+
+
+def capture_statements(client, url):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+    return response.status_code, statements
+
+
+@app.cli.command("explain-queries", with_appcontext=False)
+def explain_queries_command():
+    """Print the SQLite query plan of every SQL statement each page runs."""
+    with app.app_context():
+        args = sample_route_args()
+        admin = db.session.scalar(db.select(User.user_id).filter_by(is_admin=True).limit(1))
+        student = db.session.scalar(db.select(User.user_id).filter_by(is_admin=False).limit(1))
+
+    for rule in explainable_routes():
+        session_user = admin if rule.rule.startswith("/admin") else student
+        if rule.rule.startswith("/user") and not student:
+            print(f"{rule.rule}: skipped, there is no non-admin user")
+            continue
+        if any(args.get(name) is None for name in rule.arguments):
+            print(f"{rule.rule}: skipped, no rows to fill {sorted(rule.arguments)}")
+            continue
+
+        with app.test_request_context():
+            url = url_for(rule.endpoint, **{name: args[name] for name in rule.arguments})
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["user_id"] = session_user
+
+        status, statements = capture_statements(client, url)
+        print(f"\n=== {rule.endpoint} {url} ({status}, {len(statements)} queries)")
+
+        with app.app_context():
+            seen = set()
+            for statement, parameters in statements:
+                if statement in seen:
+                    continue
+                seen.add(statement)
+                print(" ".join(statement.split()))
+                plan = db.session.connection().exec_driver_sql(
+                    "EXPLAIN QUERY PLAN " + statement, parameters).all()
+                for row in plan:
+                    print("    " + row[-1])
@@ -0,0 +1,90 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timedelta
+
+from application.models import db, User, Subject, Chapter, Quiz, Score, ScoreArchive
+
+
+# ------------ Streaming score export ------------
+
+# rows fetched from the database cursor at a time
+CHUNK_SIZE = 1000
+
+COLUMNS = ["score_id", "time_stamp_of_attempt", "total_score", "user_id", "username", "name",
+           "quiz_id", "date_of_quiz", "chapter_id", "chapter", "subject_id", "subject"]
+
+
+def parse_date(value):
+    # raises ValueError for anything but YYYY-MM-DD
+    return datetime.strptime(value, "%Y-%m-%d") if value else None
+
+
+def scores_query(quiz_id=None, subject_id=None, date_from=None, date_to=None, model=Score):
+    query = (
+        db.select(model.score_id, model.time_stamp_of_attempt, model.total_score,
+                  User.user_id, User.username, User.name,
+                  Quiz.quiz_id, Quiz.date_of_quiz,
+                  Chapter.chapter_id, Chapter.name, Subject.subject_id, Subject.name)
+        .join(User, User.user_id == model.user_id)
+        .join(Quiz, Quiz.quiz_id == model.quiz_id)
+        .join(Chapter, Chapter.chapter_id == Quiz.chapter_id)
+        .join(Subject, Subject.subject_id == Chapter.subject_id)
+        .order_by(model.score_id)
+    )
+    if quiz_id:
+        query = query.filter(model.quiz_id == quiz_id)
+    if subject_id:
+        query = query.filter(Subject.subject_id == subject_id)
+    if date_from:
+        query = query.filter(model.time_stamp_of_attempt >= date_from)
+    if date_to:
+        # the end date is inclusive
+        query = query.filter(model.time_stamp_of_attempt < date_to + timedelta(days=1))
+    return query
+
+
+def scores_queries(**filters):
+    # archived scores are older, so the rows stay in score_id order
+    return [scores_query(**filters, model=ScoreArchive), scores_query(**filters)]
+
+
+def iter_rows(*queries):
+    # yield_per streams the result from the cursor instead of buffering every row
+    for query in queries:
+        result = db.session.execute(query.execution_options(yield_per=CHUNK_SIZE))
+        for partition in result.partitions():
+            yield from partition
+
+
+def format_value(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def iter_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow([format_value(value) for value in row])
+        if count % CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_ndjson(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(COLUMNS, map(format_value, row)))) + "\n"
+
+
+def gzip_stream(chunks):
+    # wbits=31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,248 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+from app import app
+from sqlalchemy.dialects.sqlite import insert
+
+from application.models import db, Score, ScoreArchive, AnswerSheet, Attempt, ScoreIdSequence
+from application import stats
+
+
+# ------------ Group commit of quiz submissions ------------
+
+class ScoreWriter:
+    """Background writer that inserts queued scores in batches, one transaction per batch.
+
+    submit() returns a Future that resolves once the batch holding the score is committed.
+    """
+
+    def __init__(self, batch_size, batch_delay, queue_size):
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.start_lock = threading.Lock()
+
+        self.metrics_lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.batches = 0
+        self.rows = 0
+        self.max_batch = 0
+        self.failed_batches = 0
+        self.retried_rows = 0
+        self.failed_rows = 0
+        self.lock_wait = 0.0
+        self.max_lock_wait = 0.0
+        self.write_time = 0.0
+        self.max_write_time = 0.0
+        self.commit_time = 0.0
+
+    def ensure_started(self):
+        # started on first use, so under a pre-fork server each worker gets its own thread
+        if self.thread and self.thread.is_alive():
+            return
+        with self.start_lock:
+            if not (self.thread and self.thread.is_alive()):
+                self.thread = threading.Thread(target=self.run, name="score-writer", daemon=True)
+                self.thread.start()
+
+    def submit(self, score):
+        # raises queue.Full when the writer is too far behind
+        self.ensure_started()
+        future = Future()
+        self.queue.put((score, future), timeout=1)
+        return future
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.batch_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            with app.app_context():
+                try:
+                    self.write(batch)
+                except Exception as error:
+                    db.session.rollback()
+                    with self.metrics_lock:
+                        self.failed_batches += 1
+                    if len(batch) == 1:
+                        batch[0][1].set_exception(error)
+                    else:
+                        # one bad row must not fail the whole batch, the rows are retried alone
+                        self.retry(batch)
+                    continue
+            for _, future in batch:
+                future.set_result(True)
+
+    def retry(self, batch):
+        for item in batch:
+            try:
+                self.write([item])
+            except Exception as error:
+                db.session.rollback()
+                with self.metrics_lock:
+                    self.failed_rows += 1
+                item[1].set_exception(error)
+            else:
+                item[1].set_result(True)
+        with self.metrics_lock:
+            self.retried_rows += len(batch)
+
+    def write(self, batch):
+        # takes SQLite's single writer lock up front, so waiting for it is timed on its own
+        started = time.monotonic()
+        db.session.execute(db.text("BEGIN IMMEDIATE"))
+        lock_wait = time.monotonic() - started
+
+        # copies, the queued rows stay intact for a retry
+        started = time.monotonic()
+        rows = closing_attempts([dict(score) for score, _ in batch])
+        if not rows:
+            db.session.commit()
+            return
+        sheets = [row.pop("answer_sheet", None) for row in rows]
+
+        score_ids = allocate_score_ids(len(rows))
+        for score_id, row in zip(score_ids, rows):
+            row["score_id"] = score_id
+        db.session.execute(db.insert(Score), rows)
+
+        sheet_rows = [dict(score_id=score_id, quiz_id=row["quiz_id"], layout=sheet[0],
+                           answers=sheet[1])
+                      for score_id, row, sheet in zip(score_ids, rows, sheets) if sheet]
+        if sheet_rows:
+            db.session.execute(db.insert(AnswerSheet), sheet_rows)
+
+        for row in rows:
+            stats.record_score(row["user_id"], row["total_score"])
+            stats.record_quiz_score(row["quiz_id"], row["total_score"])
+        write_time = time.monotonic() - started
+
+        started = time.monotonic()
+        db.session.commit()
+        commit_time = time.monotonic() - started
+
+        with self.metrics_lock:
+            self.batches += 1
+            self.rows += len(rows)
+            self.max_batch = max(self.max_batch, len(rows))
+            self.lock_wait += lock_wait
+            self.max_lock_wait = max(self.max_lock_wait, lock_wait)
+            self.write_time += write_time
+            self.max_write_time = max(self.max_write_time, write_time)
+            self.commit_time += commit_time
+
+    def metrics(self):
+        with self.metrics_lock:
+            elapsed = time.monotonic() - self.started_at
+            return dict(
+                queued=self.queue.qsize(),
+                batches=self.batches,
+                rows=self.rows,
+                failed_batches=self.failed_batches,
+                retried_rows=self.retried_rows,
+                failed_rows=self.failed_rows,
+                avg_batch_size=self.rows / self.batches if self.batches else 0,
+                max_batch_size=self.max_batch,
+                rows_per_second=self.rows / elapsed if elapsed else 0,
+                avg_lock_wait_ms=self.lock_wait / self.batches * 1000 if self.batches else 0,
+                max_lock_wait_ms=self.max_lock_wait * 1000,
+                avg_write_ms=self.write_time / self.batches * 1000 if self.batches else 0,
+                max_write_ms=self.max_write_time * 1000,
+                avg_commit_ms=self.commit_time / self.batches * 1000 if self.batches else 0,
+            )
+
+
+def allocate_score_ids(count):
+    """Reserve `count` score ids above every id handed out before, in the caller's transaction.
+
+    SQLite would give a new row the highest rowid of the table plus one, reusing the ids
+    of the newest scores once they are archived or deleted. These ids are never reused,
+    so they stay unique across Score and ScoreArchive.
+    """
+    # the table maxima also cover a database whose sequence row does not exist yet
+    highest = db.func.max(
+        db.func.coalesce(db.select(db.func.max(Score.score_id)).scalar_subquery(), 0),
+        db.func.coalesce(db.select(db.func.max(ScoreArchive.score_id)).scalar_subquery(), 0))
+    statement = insert(ScoreIdSequence).values(id=1, last_id=highest + count)
+    last_id = db.session.execute(statement.on_conflict_do_update(
+        index_elements=[ScoreIdSequence.id],
+        set_=dict(last_id=db.func.max(ScoreIdSequence.last_id, highest) + count))
+        .returning(ScoreIdSequence.last_id)).scalar_one()
+    return range(last_id - count + 1, last_id + 1)
+
+
+def closing_attempts(rows):
+    """Delete the attempts the scores were graded from and drop scores of attempts
+    already gone, so a submit sent twice is only saved once."""
+    attempt_ids = {row["attempt_id"] for row in rows if row.get("attempt_id") is not None}
+    if attempt_ids:
+        attempt_ids = set(db.session.execute(
+            db.delete(Attempt).filter(Attempt.attempt_id.in_(attempt_ids))
+            .returning(Attempt.attempt_id)).scalars())
+    kept = []
+    for row in rows:
+        attempt_id = row.pop("attempt_id", None)
+        if attempt_id is None or attempt_id in attempt_ids:
+            attempt_ids.discard(attempt_id)
+            kept.append(row)
+    return kept
+
+
+writer = ScoreWriter(batch_size=app.config['SCORE_BATCH_SIZE'],
+                     batch_delay=app.config['SCORE_BATCH_DELAY_MS'] / 1000,
+                     queue_size=app.config['SCORE_QUEUE_SIZE'])
+
+
+def save_score(quiz_id, user_id, total_score, time_stamp, answer_sheet=None, attempt_id=None):
+    """Insert a Score and its (layout, packed answers) answer sheet, through the
+    group-commit writer when it is enabled. The attempt it was graded from is
+    deleted in the same transaction.
+
+    Returns True once the score is durable, or False when the writer has not
+    committed it within SCORE_COMMIT_TIMEOUT; it is still saved afterwards. Falls
+    back to a direct commit when the writer queue is full. Raises the database
+    error when the score could not be saved.
+    """
+    score = dict(quiz_id=quiz_id, user_id=user_id, total_score=total_score,
+                 time_stamp_of_attempt=time_stamp)
+
+    if app.config['SCORE_GROUP_COMMIT']:
+        # hand the pooled connection back while waiting, the writer needs one for the batch
+        db.session.close()
+        try:
+            future = writer.submit(dict(score, answer_sheet=answer_sheet, attempt_id=attempt_id))
+        except queue.Full:
+            pass
+        else:
+            try:
+                future.result(timeout=app.config['SCORE_COMMIT_TIMEOUT'])
+            except TimeoutError:
+                return False
+            return True
+
+    if not closing_attempts([dict(score, attempt_id=attempt_id)]):
+        db.session.rollback()
+        return True
+    score = Score(score_id=allocate_score_ids(1)[0], **score)
+    if answer_sheet:
+        score.answer_sheet = AnswerSheet(quiz_id=quiz_id, layout=answer_sheet[0],
+                                         answers=answer_sheet[1])
+    db.session.add(score)
+    stats.record_score(user_id, total_score)
+    stats.record_quiz_score(quiz_id, total_score)
+    db.session.commit()
+    return True
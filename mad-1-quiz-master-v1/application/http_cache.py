@@ -0,0 +1,154 @@
+import gzip
+import hashlib
+import os
+from functools import wraps
+
+from flask import g, request, session, message_flashed
+
+from app import app
+from application.models import db, QuizAnalysis, Score, UserScoreRollup
+from application import catalog
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# ------------ Conditional GET ------------
+
+# A page's ETag hashes the version stamps of the data it shows, the signed in user and
+# the URL. The stamps are read before the view runs, so a matching If-None-Match is
+# answered with 304 without loading the page's rows or rendering its template.
+
+def build_stamp():
+    # templates and code of this deployment, so a new release does not answer 304
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    mtimes = []
+    for folder, extension in (("templates", ".html"), ("application", ".py")):
+        for path, folders, files in os.walk(os.path.join(root, folder)):
+            # bytecode is rewritten whenever it goes stale, it is not part of the release
+            folders[:] = sorted(name for name in folders if name != "__pycache__")
+            mtimes += [os.stat(os.path.join(path, name)).st_mtime_ns for name in sorted(files)
+                       if name.endswith(extension)]
+    return hashlib.blake2b(repr(mtimes).encode(), digest_size=8).hexdigest()
+
+
+BUILD = build_stamp()
+
+
+def page_etag(stamp):
+    text = repr((BUILD, session.get("user_id"), request.full_path, stamp))
+    return hashlib.blake2b(text.encode(), digest_size=12).hexdigest()
+
+
+def matching_etag(etag):
+    # compressed responses carry the encoding in their ETag, see compress()
+    for variant in (etag, f"{etag}-gzip", f"{etag}-br"):
+        if request.if_none_match.contains(variant):
+            return variant
+    return None
+
+
+def conditional(stamp):
+    """Answer GET requests with 304 while `stamp(**view_args)` is unchanged.
+
+    The stamp returns any repr()-able version of the data the page shows, or None
+    when the page cannot be cached.
+    """
+    def decorator(func):
+        @wraps(func)
+        def inner(*args, **kwargs):
+            # a page showing flashed messages must not be served again from the cache
+            if request.method != "GET" or session.get("_flashes"):
+                return func(*args, **kwargs)
+            version = stamp(**kwargs)
+            if version is None:
+                return func(*args, **kwargs)
+            etag = page_etag(version)
+            matched = matching_etag(etag)
+            if matched:
+                response = app.response_class(status=304)
+                response.set_etag(matched)
+                response.headers["Cache-Control"] = "private, no-cache"
+                return response
+
+            response = app.make_response(func(*args, **kwargs))
+            if response.status_code == 200 and not g.get("flashed"):
+                response.set_etag(etag)
+                response.headers["Cache-Control"] = "private, no-cache"
+            return response
+        return inner
+    return decorator
+
+
+def note_flash(sender, message, category):
+    g.flashed = True
+
+
+message_flashed.connect(note_flash, app)
+
+
+# version stamps, each one small primary key or aggregate read
+
+def catalog_stamp(**kwargs):
+    return catalog.current_version()
+
+
+def analysis_stamp(quiz_id=None, **kwargs):
+    # item analyses are written without bumping the catalog version
+    analyzed = db.select(db.func.max(QuizAnalysis.analyzed_at))
+    if quiz_id is not None:
+        analyzed = analyzed.filter_by(quiz_id=quiz_id)
+    return catalog.current_version(), db.session.scalar(analyzed)
+
+
+def score_stamp(**kwargs):
+    # the count and newest id of the user's scores change on every insert and delete,
+    # archiving moves scores into the rollups and quiz names come from the catalog
+    user_id = session.get("user_id")
+    archived = (db.select(db.func.sum(UserScoreRollup.attempts))
+                .filter_by(user_id=user_id, period="week").scalar_subquery())
+    row = db.session.execute(
+        db.select(db.func.count(Score.score_id), db.func.max(Score.score_id), archived)
+        .filter_by(user_id=user_id)).one()
+    return (catalog.current_version(), *row)
+
+
+# ------------ Response compression ------------
+
+COMPRESSIBLE = {"text/html", "text/plain", "text/css", "text/csv", "application/json",
+                "application/javascript", "image/svg+xml"}
+
+
+def choose_encoding():
+    offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+    return request.accept_encodings.best_match(offered)
+
+
+@app.after_request
+def compress(response):
+    if response.mimetype not in COMPRESSIBLE:
+        return response
+    response.vary.add("Accept-Encoding")
+    # streamed and file responses are sent as they are
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers):
+        return response
+    data = response.get_data()
+    if len(data) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+    encoding = choose_encoding()
+    if encoding == "br":
+        data = brotli.compress(data, quality=app.config['BROTLI_QUALITY'])
+    elif encoding == "gzip":
+        data = gzip.compress(data, compresslevel=app.config['COMPRESS_LEVEL'], mtime=0)
+    else:
+        return response
+
+    response.set_data(data)
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
@@ -0,0 +1,234 @@
+import random
+import time
+from bisect import bisect_left
+from collections import Counter
+from threading import Lock
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import app
+from application.models import db
+
+
+# ------------ Per-request SQL and latency instrumentation ------------
+
+# A sampled request collects its wall time, SQL statements, SQL time and rows fetched in g;
+# at teardown they are added to fixed-bucket histograms per endpoint. Requests that are not
+# sampled only pay for one random() call.
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+ROW_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+# statements kept per endpoint in the N+1 report
+MAX_REPEATED_STATEMENTS = 20
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # the last count is the +Inf bucket
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0
+
+    def quantile(self, fraction):
+        # interpolated inside the bucket holding the quantile, like Prometheus' histogram_quantile
+        if not self.count:
+            return 0
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.bounds[index - 1] if index else 0
+                if index == len(self.bounds):
+                    return lower
+                return lower + (self.bounds[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+
+class EndpointMetrics:
+    def __init__(self):
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.statements = Histogram(STATEMENT_BUCKETS)
+        self.sql_duration = Histogram(DURATION_BUCKETS)
+        self.rows = Histogram(ROW_BUCKETS)
+        self.errors = 0
+        self.n_plus_one = 0
+        # statement -> [requests it repeated in, most repeats in one request]
+        self.repeated = {}
+
+
+class RequestMetrics:
+    __slots__ = ("started", "statements", "sql_duration", "rows", "texts", "status")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.sql_duration = 0.0
+        self.rows = 0
+        self.texts = Counter()
+        self.status = None
+
+
+class Registry:
+    def __init__(self):
+        self.lock = Lock()
+        self.endpoints = {}
+        self.started_at = time.time()
+
+    def record(self, endpoint, metrics, failed, threshold):
+        duration = time.perf_counter() - metrics.started
+        repeated = [(text, times) for text, times in metrics.texts.items() if times >= threshold]
+        with self.lock:
+            endpoint_metrics = self.endpoints.get(endpoint)
+            if endpoint_metrics is None:
+                endpoint_metrics = self.endpoints[endpoint] = EndpointMetrics()
+            endpoint_metrics.duration.observe(duration)
+            endpoint_metrics.statements.observe(metrics.statements)
+            endpoint_metrics.sql_duration.observe(metrics.sql_duration)
+            endpoint_metrics.rows.observe(metrics.rows)
+            if failed:
+                endpoint_metrics.errors += 1
+            if repeated:
+                endpoint_metrics.n_plus_one += 1
+            for text, times in repeated:
+                entry = endpoint_metrics.repeated.get(text)
+                if entry is None:
+                    if len(endpoint_metrics.repeated) >= MAX_REPEATED_STATEMENTS:
+                        continue
+                    entry = endpoint_metrics.repeated[text] = [0, 0]
+                entry[0] += 1
+                entry[1] = max(entry[1], times)
+
+    def snapshot(self):
+        with self.lock:
+            return sorted(self.endpoints.items())
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+            self.started_at = time.time()
+
+
+registry = Registry()
+
+
+def current():
+    # the metrics of the running request, None outside requests and for unsampled ones
+    if has_request_context():
+        return g.get("request_metrics")
+    return None
+
+
+@app.before_request
+def start_request_metrics():
+    if random.random() < app.config['METRICS_SAMPLE_RATE']:
+        g.request_metrics = RequestMetrics()
+
+
+@app.after_request
+def note_status(response):
+    metrics = current()
+    if metrics is not None:
+        metrics.status = response.status_code
+    return response
+
+
+@app.teardown_request
+def record_request_metrics(exc):
+    metrics = g.pop("request_metrics", None)
+    if metrics is None:
+        return
+    failed = exc is not None or (metrics.status or 500) >= 500
+    registry.record(request.endpoint or "unmatched", metrics, failed,
+                    app.config['N_PLUS_ONE_THRESHOLD'])
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current() is not None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics = current()
+    if metrics is None or not conn.info.get("query_started"):
+        return
+    metrics.sql_duration += time.perf_counter() - conn.info["query_started"].pop()
+    metrics.statements += 1
+    # the same text with different parameters, e.g. one lazy load per parent row
+    metrics.texts[statement] += 1
+
+
+def count_rows(orm_execute_state):
+    # rows are only counted for buffered selects, streamed results are left alone
+    metrics = current()
+    options = orm_execute_state.execution_options
+    if metrics is None or not orm_execute_state.is_select or options.get("yield_per") \
+            or options.get("stream_results"):
+        return None
+    frozen = orm_execute_state.invoke_statement().freeze()
+    metrics.rows += len(frozen.data)
+    return frozen()
+
+
+with app.app_context():
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(db.engine, "after_cursor_execute", after_cursor_execute)
+event.listen(Session, "do_orm_execute", count_rows)
+
+
+# ------------ Prometheus text format ------------
+
+def label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def histogram_lines(name, endpoint, histogram):
+    cumulative = 0
+    for bound, count in zip(list(histogram.bounds) + ["+Inf"], histogram.counts):
+        cumulative += count
+        yield f'{name}_bucket{{endpoint="{label(endpoint)}",le="{bound}"}} {cumulative}'
+    yield f'{name}_sum{{endpoint="{label(endpoint)}"}} {histogram.sum}'
+    yield f'{name}_count{{endpoint="{label(endpoint)}"}} {histogram.count}'
+
+
+HISTOGRAMS = [
+    ("quiz_request_duration_seconds", "duration", "Wall time of sampled requests."),
+    ("quiz_request_sql_statements", "statements", "SQL statements per sampled request."),
+    ("quiz_request_sql_duration_seconds", "sql_duration", "SQL time per sampled request."),
+    ("quiz_request_rows_fetched", "rows", "Rows fetched by ORM selects per sampled request."),
+]
+
+
+def prometheus_text():
+    endpoints = registry.snapshot()
+    lines = ["# HELP quiz_metrics_sample_rate Share of requests that are instrumented.",
+             "# TYPE quiz_metrics_sample_rate gauge",
+             f"quiz_metrics_sample_rate {app.config['METRICS_SAMPLE_RATE']}"]
+    with registry.lock:
+        for name, attribute, description in HISTOGRAMS:
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+            for endpoint, metrics in endpoints:
+                lines += histogram_lines(name, endpoint, getattr(metrics, attribute))
+        for name, attribute, description in [
+                ("quiz_request_errors_total", "errors", "Sampled requests that failed."),
+                ("quiz_request_n_plus_one_total", "n_plus_one",
+                 "Sampled requests that repeated an identical statement.")]:
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+            lines += [f'{name}{{endpoint="{label(endpoint)}"}} {getattr(metrics, attribute)}'
+                      for endpoint, metrics in endpoints]
+    return "\n".join(lines) + "\n"
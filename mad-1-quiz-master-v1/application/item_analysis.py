@@ -0,0 +1,140 @@
+import math
+import time
+from datetime import datetime
+
+import click
+
+from app import app
+from application.models import db, AnswerSheet, AnswerSheetArchive, ItemAnalysis, QuizAnalysis
+from application import answer_key
+
+
+# ------------ Item analysis ------------
+
+# questions outside these bounds are pointed out on the analysis page
+TOO_EASY = 0.9
+TOO_HARD = 0.2
+LOW_DISCRIMINATION = 0.2
+
+
+def load_answers(quiz_id):
+    """Return (answers, correct options, question ids) for the current questions of a quiz.
+
+    answers is an (attempts, questions) int8 matrix of chosen options, 0 for
+    unanswered. Sheets of attempts made before the questions changed are left out.
+    """
+    import numpy as np
+
+    question_ids, correct_options = answer_key.get_answer_key(quiz_id)
+    layout = answer_key.get_layout(quiz_id)
+    sheets = db.session.execute(db.union_all(*(
+        db.select(model.answers).filter_by(quiz_id=quiz_id, layout=layout)
+        for model in (AnswerSheet, AnswerSheetArchive)))).scalars().all()
+    if not sheets or not len(question_ids):
+        return np.zeros((0, len(question_ids)), dtype=np.int8), correct_options, question_ids
+    return answer_key.unpack_answers(sheets, len(question_ids)), correct_options, question_ids
+
+
+def analyze(answers, correct_options):
+    """Classical test theory statistics of an (attempts, questions) answer matrix.
+
+    Every statistic is computed for all questions at once; statistics that are
+    undefined, e.g. the discrimination of a question everybody got right, are NaN.
+    """
+    import numpy as np
+
+    attempts, questions = answers.shape
+    correct = (answers == correct_options).astype(np.float64)
+    totals = correct.sum(axis=1)
+
+    difficulty = correct.mean(axis=0)
+    item_var = difficulty * (1 - difficulty)
+    total_mean = totals.mean()
+    total_var = totals.var()
+
+    # point-biserial correlation of each question with the rest score, the total without
+    # the question itself, so a question does not correlate with its own contribution
+    item_total_cov = totals @ correct / attempts - difficulty * total_mean
+    item_rest_cov = item_total_cov - item_var
+    rest_var = total_var + item_var - 2 * item_total_cov
+    with np.errstate(divide="ignore", invalid="ignore"):
+        discrimination = item_rest_cov / np.sqrt(item_var * rest_var)
+
+    # chosen option counts per question, column 0 is unanswered
+    offsets = np.arange(questions, dtype=np.int64) * 5
+    options = np.bincount((answers.astype(np.int64) + offsets).ravel(),
+                          minlength=questions * 5).reshape(questions, 5)
+
+    if questions > 1 and total_var > 0:
+        kr20 = questions / (questions - 1) * (1 - item_var.sum() / total_var)
+    else:
+        kr20 = np.nan
+
+    return dict(attempts=attempts, difficulty=difficulty, discrimination=discrimination,
+                options=options, kr20=kr20, mean_score=total_mean)
+
+
+def optional(value):
+    # NaN statistics are stored as NULL
+    return None if math.isnan(value) else float(value)
+
+
+def analyze_quiz(quiz_id):
+    """Recompute and store the item analysis of one quiz, returns the number of attempts."""
+    answers, correct_options, question_ids = load_answers(quiz_id)
+    db.session.execute(db.delete(ItemAnalysis).filter_by(quiz_id=quiz_id))
+    db.session.execute(db.delete(QuizAnalysis).filter_by(quiz_id=quiz_id))
+    if not len(answers):
+        db.session.commit()
+        return 0
+
+    result = analyze(answers, correct_options)
+    db.session.execute(db.insert(ItemAnalysis), [
+        dict(question_id=question_id, quiz_id=quiz_id, difficulty=float(difficulty),
+             discrimination=optional(discrimination), unanswered=int(options[0]),
+             option1=int(options[1]), option2=int(options[2]), option3=int(options[3]),
+             option4=int(options[4]))
+        for question_id, difficulty, discrimination, options in zip(
+            question_ids.tolist(), result["difficulty"], result["discrimination"],
+            result["options"])
+    ])
+    db.session.add(QuizAnalysis(quiz_id=quiz_id, attempts=result["attempts"],
+                                kr20=optional(result["kr20"]),
+                                mean_score=float(result["mean_score"]),
+                                analyzed_at=datetime.now()))
+    db.session.commit()
+    return result["attempts"]
+
+
+def analyze_all():
+    quiz_ids = db.session.execute(db.union(*(
+        db.select(model.quiz_id) for model in (AnswerSheet, AnswerSheetArchive)))).scalars().all()
+    return {quiz_id: analyze_quiz(quiz_id) for quiz_id in quiz_ids}
+
+
+def review_notes(item, correct_option):
+    # short hints for the admin, the thresholds are rules of thumb
+    notes = []
+    if item.difficulty >= TOO_EASY:
+        notes.append("too easy")
+    elif item.difficulty <= TOO_HARD:
+        notes.append("too hard")
+    if item.discrimination is not None and item.discrimination < 0:
+        notes.append("negative discrimination, check the answer key")
+    elif item.discrimination is not None and item.discrimination < LOW_DISCRIMINATION:
+        notes.append("low discrimination")
+    counts = [item.option1, item.option2, item.option3, item.option4]
+    if 1 <= correct_option <= 4 and max(counts) > counts[correct_option - 1]:
+        notes.append(f"option {counts.index(max(counts)) + 1} is chosen more than the answer")
+    return notes
+
+
+@app.cli.command("analyze-items")
+@click.option("--quiz-id", type=int, help="Only analyze this quiz.")
+def analyze_items_command(quiz_id):
+    """Recompute question difficulty, discrimination and reliability from the answer sheets."""
+    started = time.perf_counter()
+    results = {quiz_id: analyze_quiz(quiz_id)} if quiz_id else analyze_all()
+    for analyzed_quiz, attempts in results.items():
+        print(f"quiz {analyzed_quiz}: {attempts} attempts")
+    print(f"Analyzed {len(results)} quizzes in {time.perf_counter() - started:.2f}s")
@@ -1,8 +1,9 @@
+import os
 from app import app
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash
-from sqlalchemy import Column, TIMESTAMP
+from sqlalchemy import Column, TIMESTAMP, event
 from datetime import datetime
+from application.database import set_sqlite_pragmas
 import pytz
 
 db = SQLAlchemy(app)
@@ -26,7 +27,7 @@ class Subject(db.Model):
 
 class Chapter(db.Model):
     chapter_id = db.Column(db.Integer, primary_key=True)
-    subject_id = db.Column(db.Integer, db.ForeignKey('subject.subject_id'))
+    subject_id = db.Column(db.Integer, db.ForeignKey('subject.subject_id'), index=True)
     name = db.Column(db.String(64), unique=True)
     description = db.Column(db.String(256))
     
@@ -34,23 +35,27 @@ class Chapter(db.Model):
 
 class Quiz(db.Model):
     quiz_id = db.Column(db.Integer, primary_key=True)
-    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.chapter_id'))
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.chapter_id'), index=True)
     date_of_quiz = db.Column(db.Date)
     time_duration = db.Column(db.Integer, nullable=False)
     remarks = db.Column(db.Text)
     
     scores = db.relationship('Score', backref='quiz', lazy=True, cascade='all, delete-orphan')
     questions = db.relationship('Question', backref='quiz', lazy=True, cascade='all, delete-orphan')
+    score_buckets = db.relationship('QuizScoreBucket', lazy=True, cascade='all, delete-orphan')
+    analysis = db.relationship('QuizAnalysis', uselist=False, lazy=True, cascade='all, delete-orphan')
 
 class Question(db.Model):
     question_id = db.Column(db.Integer, primary_key=True)
-    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.quiz_id'))
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.quiz_id'), index=True)
     question_statement = db.Column(db.Text, nullable=False)
     option1 = db.Column(db.Text, nullable=False)
     option2 = db.Column(db.Text, nullable=False)
     option3 = db.Column(db.Text, nullable=False)
     option4 = db.Column(db.Text, nullable=False)
     correct_option = db.Column(db.Integer, nullable=False)
+
+    item_analysis = db.relationship('ItemAnalysis', uselist=False, lazy=True, cascade='all, delete-orphan')
     
 
 ist_tz = pytz.timezone('Asia/Kolkata')
@@ -62,13 +67,153 @@ class Score(db.Model):
     time_stamp_of_attempt = db.Column(TIMESTAMP(timezone=True), default=lambda: datetime.now(ist_tz))
     total_score = db.Column(db.Integer)
 
+    answer_sheet = db.relationship('AnswerSheet', uselist=False, lazy=True, cascade='all, delete-orphan')
+
+    # these also serve the plain quiz_id and user_id lookups
+    __table_args__ = (
+        db.Index('ix_score_quiz_id_total_score', 'quiz_id', 'total_score'),
+        db.Index('ix_score_user_id_time_stamp', 'user_id', 'time_stamp_of_attempt'),
+    )
+
+
+# Scores moved out of Score by `flask archive-scores`, see application/archive.py
+class ScoreArchive(db.Model):
+    score_id = db.Column(db.Integer, primary_key=True)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.quiz_id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.user_id'))
+    time_stamp_of_attempt = db.Column(TIMESTAMP(timezone=True))
+    total_score = db.Column(db.Integer)
+
+    __table_args__ = (
+        db.Index('ix_score_archive_quiz_id_total_score', 'quiz_id', 'total_score'),
+        db.Index('ix_score_archive_user_id_time_stamp', 'user_id', 'time_stamp_of_attempt'),
+    )
+
+# Answer sheets of archived scores, moved along with them
+class AnswerSheetArchive(db.Model):
+    score_id = db.Column(db.Integer, db.ForeignKey('score_archive.score_id'), primary_key=True)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.quiz_id'), nullable=False)
+    layout = db.Column(db.BigInteger, nullable=False)
+    answers = db.Column(db.LargeBinary, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_answer_sheet_archive_quiz_id_layout', 'quiz_id', 'layout'),
+    )
+
+# Totals of the archived scores of a user or quiz per day and per week (period 'day' or
+# 'week', a week starts on Monday); histogram is a JSON object of total_score -> count
+class UserScoreRollup(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.user_id'), primary_key=True)
+    period = db.Column(db.String(4), primary_key=True)
+    period_start = db.Column(db.Date, primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False)
+    score_sum = db.Column(db.Integer, nullable=False)
+    max_score = db.Column(db.Integer, nullable=False)
+    histogram = db.Column(db.Text, nullable=False)
+
+class QuizScoreRollup(db.Model):
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.quiz_id'), primary_key=True)
+    period = db.Column(db.String(4), primary_key=True)
+    period_start = db.Column(db.Date, primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False)
+    score_sum = db.Column(db.Integer, nullable=False)
+    max_score = db.Column(db.Integer, nullable=False)
+    histogram = db.Column(db.Text, nullable=False)
+
+
+# Running per-user aggregates of Score, kept in step with every Score insert
+class UserStats(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.user_id'), primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    score_sum = db.Column(db.Integer, nullable=False, default=0)
+    max_score = db.Column(db.Integer, nullable=False, default=0)
+
+# Histogram of a user's scores in buckets of 10 (bucket 10 holds the 100% scores)
+class UserScoreBucket(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.user_id'), primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+# Number of attempts of a quiz for every percentage score 0..100, used for percentile ranks
+class QuizScoreBucket(db.Model):
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.quiz_id'), primary_key=True)
+    score = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+# A quiz in progress: one open attempt per student and quiz, removed once graded
+class Attempt(db.Model):
+    attempt_id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.user_id'), nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.quiz_id'), nullable=False, index=True)
+    started_at = db.Column(db.DateTime, nullable=False)
+    deadline = db.Column(db.DateTime, nullable=False, index=True)
+    # JSON object of question id -> chosen option
+    answers = db.Column(db.Text, nullable=False, default='{}')
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'quiz_id'),
+    )
+
+# The answers of one graded attempt, packed by application/answer_key.pack_answers
+class AnswerSheet(db.Model):
+    score_id = db.Column(db.Integer, db.ForeignKey('score.score_id'), primary_key=True)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.quiz_id'), nullable=False)
+    # identifies the question ids the answers are aligned to
+    layout = db.Column(db.BigInteger, nullable=False)
+    answers = db.Column(db.LargeBinary, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_answer_sheet_quiz_id_layout', 'quiz_id', 'layout'),
+    )
+
+# Results of the last item analysis run, see application/item_analysis.py
+class QuizAnalysis(db.Model):
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.quiz_id'), primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False)
+    # KR-20 reliability, None when it is undefined
+    kr20 = db.Column(db.Float)
+    mean_score = db.Column(db.Float)
+    analyzed_at = db.Column(db.DateTime, nullable=False)
+
+class ItemAnalysis(db.Model):
+    question_id = db.Column(db.Integer, db.ForeignKey('question.question_id'), primary_key=True)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.quiz_id'), nullable=False, index=True)
+    # share of attempts answering correctly
+    difficulty = db.Column(db.Float, nullable=False)
+    # point-biserial correlation with the score on the other questions
+    discrimination = db.Column(db.Float)
+    unanswered = db.Column(db.Integer, nullable=False)
+    option1 = db.Column(db.Integer, nullable=False)
+    option2 = db.Column(db.Integer, nullable=False)
+    option3 = db.Column(db.Integer, nullable=False)
+    option4 = db.Column(db.Integer, nullable=False)
+
+# Quizzes deleted from the catalog whose scores are still being purged, see application/deletes.py
+class PendingPurge(db.Model):
+    quiz_id = db.Column(db.Integer, primary_key=True)
+    # a new quiz may get the same id, its scores come after this one
+    last_score_id = db.Column(db.Integer, nullable=False)
+    queued_at = db.Column(db.DateTime, nullable=False)
+
+# Single row (id=1) holding the last score id handed out, see group_commit.allocate_score_ids
+class ScoreIdSequence(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False)
+
+# Single row (id=1) bumped by every change to the catalog, see application/catalog.py
+class CatalogVersion(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+def dispose_after_fork():
+    # a forked worker must not share pooled connections with its parent, it opens its own
+    with app.app_context():
+        db.engine.dispose(close=False)
+
 
+# creating the engine opens no connection, the schema is created by `flask init-db`
 with app.app_context():
-    db.create_all()
-    # if admin exists, else create admin
-    admin = User.query.filter_by(is_admin=True).first()
-    if not admin:
-        password_hash = generate_password_hash('admin')
-        admin = User(username='admin', passhash=password_hash, name='Admin', is_admin=True)
-        db.session.add(admin)
-        db.session.commit()
+    if db.engine.dialect.name == "sqlite":
+        event.listen(db.engine, "connect", set_sqlite_pragmas(app))
+os.register_at_fork(after_in_child=dispose_after_fork)
@@ -0,0 +1,110 @@
+import base64
+import binascii
+import json
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+from flask import request
+
+from application.models import db
+
+
+# ------------ Keyset pagination ------------
+
+# A page is fetched with WHERE (key columns) > (last key seen) ORDER BY key LIMIT n + 1
+# instead of OFFSET, so every page costs one index range scan of n + 1 rows. The key
+# must be unique; cursors are the key of the first or last row, encoded for the URL.
+
+class Page:
+    __slots__ = ("items", "next", "prev")
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next = next_cursor
+        self.prev = prev_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+def encode_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+
+def decode_value(value):
+    if isinstance(value, dict):
+        return datetime.fromisoformat(value["dt"])
+    return value
+
+
+def encode_cursor(key):
+    text = json.dumps([encode_value(value) for value in key], separators=(",", ":"))
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, length):
+    # a cursor that does not decode to a key of the right length starts from the first page
+    if not cursor:
+        return None
+    try:
+        text = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key = [decode_value(value) for value in json.loads(text)]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        return None
+    return tuple(key) if len(key) == length else None
+
+
+def request_cursors(length):
+    """The (after, before) keys of the page asked for in the query string."""
+    after = decode_cursor(request.args.get("after"), length)
+    before = decode_cursor(request.args.get("before"), length) if after is None else None
+    return after, before
+
+
+def make_page(rows, key, after, before, per_page):
+    # rows were fetched in page order (reversed when paging backwards), one more than a page
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before is not None:
+        rows.reverse()
+    if not rows:
+        return Page(rows)
+    has_next = before is not None or more
+    has_prev = after is not None or (before is not None and more)
+    return Page(rows,
+                encode_cursor(key(rows[-1])) if has_next else None,
+                encode_cursor(key(rows[0])) if has_prev else None)
+
+
+def keyset_page(statement, columns, key, per_page, descending=False):
+    """Run one page of `statement` ordered by the unique `columns`.
+
+    `key` returns the values of `columns` for a row. The page is taken from the
+    `after`/`before` cursors of the current request.
+    """
+    after, before = request_cursors(len(columns))
+    key_columns = db.tuple_(*columns)
+    if after is not None:
+        statement = statement.filter(key_columns < after if descending else key_columns > after)
+    if before is not None:
+        statement = statement.filter(key_columns > before if descending else key_columns < before)
+    # paging backwards walks the index the other way and flips the rows afterwards
+    reverse = descending != (before is not None)
+    statement = statement.order_by(*(column.desc() if reverse else column.asc()
+                                     for column in columns)).limit(per_page + 1)
+    rows = list(db.session.execute(statement).scalars())
+    return make_page(rows, key, after, before, per_page)
+
+
+def sequence_page(items, key, per_page):
+    """The same paging over a tuple already sorted by the single value `key`."""
+    after, before = request_cursors(1)
+    if before is not None:
+        end = bisect_left(items, before[0], key=key)
+        rows = list(items[max(end - per_page - 1, 0):end])[::-1]
+    else:
+        start = bisect_right(items, after[0], key=key) if after is not None else 0
+        rows = list(items[start:start + per_page + 1])
+    return make_page(rows, lambda item: (key(item),), after, before, per_page)
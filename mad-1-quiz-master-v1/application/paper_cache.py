@@ -0,0 +1,100 @@
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError
+from threading import Lock
+
+from flask import render_template
+from markupsafe import Markup
+
+from app import app
+from application.models import db, Question
+from application import answer_key, catalog
+
+
+# ------------ Rendered quiz paper cache ------------
+
+class PaperCache:
+    """LRU cache of rendered markup, capped by total size in characters.
+
+    Concurrent misses for the same key are coalesced: the first request builds
+    the value and the others wait up to `timeout` seconds for its result before
+    building it themselves.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+        self.building = {}
+        self.lock = Lock()
+
+    def get(self, key, build, timeout=30):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            future = self.building.get(key)
+            leader = future is None
+            if leader:
+                future = self.building[key] = Future()
+
+        if not leader:
+            try:
+                return future.result(timeout=timeout)
+            except TimeoutError:
+                # the first build is slow, this request builds its own copy instead
+                return build()
+
+        try:
+            value = build()
+        except Exception as error:
+            with self.lock:
+                del self.building[key]
+            future.set_exception(error)
+            raise
+
+        with self.lock:
+            del self.building[key]
+            if len(value) <= self.max_size:
+                self.entries[key] = value
+                self.size += len(value)
+                while self.size > self.max_size:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.size -= len(evicted)
+        future.set_result(value)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+papers = PaperCache(max_size=app.config['PAPER_CACHE_SIZE'])
+
+
+def render_paper(quiz_id, question_ids=None):
+    query = db.select(Question).filter_by(quiz_id=quiz_id).order_by(Question.question_id)
+    if question_ids is not None:
+        query = query.filter(Question.question_id.in_(question_ids))
+    questions = db.session.execute(query).scalars().all()
+    return Markup(render_template("user_quiz/paper.html", questions=questions))
+
+
+def page_question_ids(quiz_id, page):
+    # pages are slices of the cached, id-ordered answer key, numbered from 1
+    page_size = app.config['QUIZ_PAGE_SIZE']
+    question_ids, _ = answer_key.get_answer_key(quiz_id)
+    return question_ids[(page - 1) * page_size:page * page_size].tolist()
+
+
+def page_count(question_count):
+    return max(-(-question_count // app.config['QUIZ_PAGE_SIZE']), 1)
+
+
+def get_paper(quiz_id, page=None):
+    """Return the rendered questions of a quiz, or of one page of it."""
+    # the catalog version changes with every question edit, so old papers are never served
+    key = (quiz_id, catalog.current_version(), page)
+    if page is None:
+        return papers.get(key, lambda: render_paper(quiz_id))
+    return papers.get(key, lambda: render_paper(quiz_id, page_question_ids(quiz_id, page)))
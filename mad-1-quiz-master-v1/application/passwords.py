@@ -0,0 +1,133 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+from app import app
+
+
+# ------------ Password hashing pool ------------
+
+class PasswordsBusy(Exception):
+    """Raised when more hashes are waiting than the pool accepts, or one is not done
+    within PASSWORD_HASH_TIMEOUT."""
+
+
+class HashPool:
+    """Runs password hashing on a few dedicated threads.
+
+    hashlib releases the GIL while hashing, so the threads use at most `workers`
+    cores and sign-ins cannot take the CPU from other requests. At most `queue_size`
+    hashes wait for a thread, further ones are turned away with PasswordsBusy.
+    """
+
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.executor = None
+        self.start_lock = threading.Lock()
+
+        self.metrics_lock = threading.Lock()
+        self.hashes = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.rehashed = 0
+        self.wait_time = 0.0
+        self.hash_time = 0.0
+
+    def get_executor(self):
+        # created on first use, so under a pre-fork server each worker gets its own threads
+        with self.start_lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                   thread_name_prefix="password-hash")
+            return self.executor
+
+    def run(self, func, *args):
+        if not self.slots.acquire(blocking=False):
+            with self.metrics_lock:
+                self.rejected += 1
+            raise PasswordsBusy()
+        queued = time.perf_counter()
+        try:
+            future = self.get_executor().submit(self.timed, queued, func, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        # the slot is held until the hash is done, also when the caller stops waiting for it
+        future.add_done_callback(lambda done: self.slots.release())
+        try:
+            return future.result(timeout=app.config['PASSWORD_HASH_TIMEOUT'])
+        except TimeoutError:
+            with self.metrics_lock:
+                self.timed_out += 1
+            raise PasswordsBusy()
+
+    def timed(self, queued, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        finished = time.perf_counter()
+        with self.metrics_lock:
+            self.hashes += 1
+            self.wait_time += started - queued
+            self.hash_time += finished - started
+        return result
+
+    def metrics(self):
+        with self.metrics_lock:
+            return dict(
+                workers=self.workers,
+                hashes=self.hashes,
+                rejected=self.rejected,
+                timed_out=self.timed_out,
+                rehashed=self.rehashed,
+                avg_wait_ms=self.wait_time / self.hashes * 1000 if self.hashes else 0,
+                avg_hash_ms=self.hash_time / self.hashes * 1000 if self.hashes else 0,
+            )
+
+
+pool = HashPool(workers=app.config['PASSWORD_HASH_WORKERS'],
+                queue_size=app.config['PASSWORD_HASH_QUEUE'])
+
+
+def hash_password(password):
+    return pool.run(generate_password_hash, password, app.config['PASSWORD_HASH_METHOD'])
+
+
+def check_password(passhash, password):
+    return pool.run(check_password_hash, passhash, password)
+
+
+def hash_method():
+    # the full method string werkzeug stores, e.g. "scrypt" is saved as "scrypt:32768:8:1",
+    # filled in from werkzeug's defaults rather than by hashing on the request thread
+    configured = app.config['PASSWORD_HASH_METHOD']
+    method, *args = configured.split(":")
+    if method == "scrypt" and not args:
+        return "scrypt:32768:8:1"
+    if method == "pbkdf2" and len(args) < 2:
+        return f"pbkdf2:{args[0] if args else 'sha256'}:{DEFAULT_PBKDF2_ITERATIONS}"
+    return configured
+
+
+def needs_rehash(passhash):
+    return passhash.split("$", 1)[0] != hash_method()
+
+
+def verify(user, password):
+    """Check a password and upgrade the stored hash when the hash settings changed.
+
+    The caller commits. Raises PasswordsBusy when the hashing pool is full or slow.
+    """
+    if not check_password(user.passhash, password):
+        return False
+    if needs_rehash(user.passhash):
+        try:
+            user.passhash = hash_password(password)
+        except PasswordsBusy:
+            # the password was right, the hash is upgraded on a later sign-in
+            return True
+        with pool.metrics_lock:
+            pool.rehashed += 1
+    return True
@@ -1,9 +1,12 @@
-from flask import render_template, request, redirect, url_for, flash, session
+from flask import render_template, request, redirect, url_for, flash, session, g, Response, stream_with_context, jsonify, send_file, abort
 from app import app
-from application.models import db, User, Subject, Chapter, Quiz, Question, Score
-from werkzeug.security import generate_password_hash, check_password_hash
+from application.models import db, User, Subject, Chapter, Quiz, Question, Score, ScoreArchive, QuizAnalysis, ItemAnalysis
+from application import answer_key, archive, attempts, bulk_import, catalog, charts, deletes, export, group_commit, http_cache, instrumentation, item_analysis, pagination, paper_cache, passwords, search, stats
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import selectinload
 from functools import wraps
-from datetime import datetime, timedelta
+from operator import attrgetter
+from datetime import datetime
 
 
 @app.route("/")
@@ -21,10 +24,18 @@ def sigin_post():
 
     user = User.query.filter_by(username=username).first()
 
-    if not user or not check_password_hash(user.passhash, password):
+    try:
+        # hashed on the password pool, which also upgrades hashes of older settings
+        verified = user is not None and passwords.verify(user, password)
+    except passwords.PasswordsBusy:
+        flash("Too many people are signing in right now, please try again in a moment.")
+        return redirect(url_for("signin"))
+
+    if not verified:
         flash("Username or password is incorrect.")
         return redirect(url_for("signin"))
 
+    db.session.commit()
     session["user_id"] = user.user_id
     flash("LogIn successful :)")
     return redirect(url_for("user"))
@@ -55,7 +66,11 @@ def signup_post():
         flash("Username already exists. Please pick another username.")
         return redirect(url_for("signup"))
 
-    pass_hash = generate_password_hash(password)
+    try:
+        pass_hash = passwords.hash_password(password)
+    except passwords.PasswordsBusy:
+        flash("Too many people are signing up right now, please try again in a moment.")
+        return redirect(url_for("signup"))
 
     new_user = User(name=name, username=username, passhash=pass_hash)
     db.session.add(new_user)
@@ -71,6 +86,24 @@ def logout():
 
 # ------------ Decorator function for authentication ------------
 
+def current_user():
+    # loaded at most once per request and shared by the decorators, views and templates
+    if "current_user" not in g:
+        g.current_user = db.session.get(User, session["user_id"]) if "user_id" in session else None
+    return g.current_user
+
+
+@app.teardown_request
+def forget_current_user(exc):
+    # g outlives the request when an outer app context is pushed, e.g. in CLI commands
+    g.pop("current_user", None)
+
+
+@app.context_processor
+def inject_user():
+    return dict(user=current_user())
+
+
 def auth_required(func):
     @wraps(func)
     def inner(*args, **kwargs):
@@ -89,7 +122,11 @@ def admin_required(func):
             flash("Please sign in first.")
             return redirect(url_for("signin"))
         
-        user = User.query.get(session["user_id"])
+        user = current_user()
+        if not user:
+            session.pop("user_id")
+            flash("Please sign in first.")
+            return redirect(url_for("signin"))
         if not user.is_admin:
             flash("You are not authorised to access this page.")
             return redirect(url_for("user"))
@@ -102,41 +139,72 @@ def admin_required(func):
 
 @app.route("/admin")
 @admin_required
+@http_cache.conditional(lambda: None if request.args.get("parameter") in ("username", "all")
+                        else catalog.current_version())
 def admin():
-    user = User.query.get(session["user_id"])
-
     parameter = request.args.get("parameter")
     query = request.args.get("query")
+    if parameter in ("subject_name", "ch_name", "username") and not search.match_expression(query):
+        # an empty search lists everything, as the plain pages do
+        if parameter == "username":
+            return redirect(url_for("user_list"))
+        parameter = None
 
-    subjects = Subject.query.all()
+    # chapters are loaded for all subjects in one extra query instead of one per subject
+    chapters = selectinload(Subject.chapters)
 
     if parameter == "subject_name":
-        subjects = Subject.query.filter(Subject.name.ilike(f'%{query}%')).all()
-        return render_template("admin.html", subjects=subjects, user=user)
+        page = search.search_ids(query, "subject")
+        ids = page.items
+        subjects = in_id_order(Subject.query.options(chapters).filter(Subject.subject_id.in_(ids)).all(),
+                               ids, "subject_id")
+        return render_template("admin.html", subjects=subjects, page=page)
     
     elif parameter == "ch_name":
-        return render_template("admin.html", subjects=subjects, user=user, 
-                               param=parameter, query=query)
+        # only the matching chapters are loaded, with the subjects they belong to
+        page = search.search_ids(query, "chapter")
+        ids = page.items
+        chapters = selectinload(Subject.chapters.and_(Chapter.chapter_id.in_(ids)))
+        subjects = Subject.query.options(chapters).filter(Subject.subject_id.in_(
+            db.select(Chapter.subject_id).filter(Chapter.chapter_id.in_(ids)))).all()
+        return render_template("admin.html", subjects=subjects, page=page)
     
     elif parameter == "username":
-        user_list = User.query.filter(User.name.ilike(f'%{query}%')).all()
-        return render_template("user_list.html", user=user, user_list=user_list)
+        page = search.search_ids(query, "user")
+        ids = page.items
+        user_list = in_id_order(User.query.filter(User.user_id.in_(ids)).all(), ids, "user_id")
+        return render_template("user_list.html", user_list=user_list, page=page)
+
+    elif parameter in ("question", "all"):
+        kinds = ["question"] if parameter == "question" else list(search.KINDS)
+        page = search.search(query, kinds)
+        results = page.items
+        question_ids = [ref_id for kind, ref_id, _, _ in results if kind == "question"]
+        quiz_ids = dict(db.session.execute(db.select(Question.question_id, Question.quiz_id)
+                                           .filter(Question.question_id.in_(question_ids))).all())
+        return render_template("search.html", results=results, quiz_ids=quiz_ids,
+                               query=query, page=page)
 
-    return render_template("admin.html", subjects=subjects, user=user)
+    return render_template("admin.html", subjects=catalog.get_catalog().subjects)
+
+
+def in_id_order(rows, ids, id_attribute):
+    # IN (...) returns rows in table order, search results are ranked
+    position = {row_id: index for index, row_id in enumerate(ids)}
+    return sorted(rows, key=lambda row: position[getattr(row, id_attribute)])
 
 
 @app.route("/admin/user_list")
 @admin_required
 def user_list():
-    user = User.query.get(session['user_id'])
-    user_list = User.query.all()
-    return render_template("user_list.html", user_list=user_list, user=user)
+    page = pagination.keyset_page(db.select(User), [User.user_id], lambda user: (user.user_id,),
+                                  app.config['LIST_PAGE_SIZE'])
+    return render_template("user_list.html", user_list=page.items, page=page)
 
 @app.route("/admin/subject/add")
 @admin_required
 def add_subject():
-    user = User.query.get(session['user_id'])
-    return render_template("subject/add.html", user=user)
+    return render_template("subject/add.html")
 
 @app.route("/admin/subject/add", methods=["POST"])
 @admin_required
@@ -159,6 +227,7 @@ def add_subject_post():
     
     new_subject = Subject(name=name, description=description)
     db.session.add(new_subject)
+    catalog.bump_version()
     db.session.commit()
 
     return redirect(url_for("admin"))
@@ -166,12 +235,11 @@ def add_subject_post():
 @app.route("/admin/subject/<int:subject_id>/edit")
 @admin_required
 def edit_subject(subject_id):
-    user = User.query.get(session['user_id'])
     subject = Subject.query.get(subject_id)
     if not subject:
         flash("Subject does not exist")
         return redirect(url_for("admin"))
-    return render_template("subject/edit.html", user=user, subject=subject)
+    return render_template("subject/edit.html", subject=subject)
 
 @app.route("/admin/subject/<int:subject_id>/edit", methods=["POST"])
 @admin_required
@@ -191,6 +259,7 @@ def edit_subject_post(subject_id):
     
     subject.name = name
     subject.description = description
+    catalog.bump_version()
     db.session.commit()
 
     return redirect(url_for("admin"))
@@ -203,8 +272,12 @@ def delete_subject(subject_id):
         flash("The subject does not exist")
         return redirect(url_for("admin"))
     
-    db.session.delete(subject)
+    queued = deletes.delete_tree(subject_id=subject_id)
+    catalog.bump_version()
     db.session.commit()
+    answer_key.invalidate()
+    if queued:
+        deletes.start_purge()
     flash("Subject deleted successfully")
     return redirect(url_for("admin"))
     
@@ -212,9 +285,8 @@ def delete_subject(subject_id):
 @app.route("/admin/chapter/<int:subject_id>/add")
 @admin_required
 def add_chapter(subject_id):
-    user = User.query.get(session["user_id"])
     subject = Subject.query.filter_by(subject_id=subject_id).first()
-    return render_template("chapter/add.html", subject=subject, user=user)
+    return render_template("chapter/add.html", subject=subject)
 
 
 @app.route("/admin/chapter/<int:subject_id>/add", methods=["POST"])
@@ -238,6 +310,7 @@ def add_chapter_post(subject_id):
     
     new_chapter = Chapter(name=name, description=description, subject_id=subject_id)
     db.session.add(new_chapter)
+    catalog.bump_version()
     db.session.commit()
     flash("New Chapter added successfully")
     return redirect(url_for("admin"))
@@ -246,9 +319,8 @@ def add_chapter_post(subject_id):
 @app.route("/admin/chapter/<int:chapter_id>/edit")
 @admin_required
 def edit_chapter(chapter_id):
-    user = User.query.get(session["user_id"])
     chapter = Chapter.query.get(chapter_id)
-    return render_template("chapter/edit.html", chapter=chapter, user=user)
+    return render_template("chapter/edit.html", chapter=chapter)
 
 @app.route("/admin/chapter/<int:chapter_id>/edit", methods=["POST"])
 @admin_required
@@ -268,6 +340,7 @@ def edit_chapter_post(chapter_id):
     
     chapter.name = name
     chapter.description = description
+    catalog.bump_version()
     db.session.commit()
     flash("Chapter edited successfully")
     return redirect(url_for("admin"))
@@ -281,28 +354,76 @@ def delete_chapter(chapter_id):
         flash("The subject does not exist")
         return redirect(url_for("admin"))
     
-    db.session.delete(chapter)
+    queued = deletes.delete_tree(chapter_id=chapter_id)
+    catalog.bump_version()
     db.session.commit()
+    answer_key.invalidate()
+    if queued:
+        deletes.start_purge()
     flash("Chapter deleted successfully")
     return redirect(url_for("admin"))
 
 @app.route("/admin/quiz")
 @admin_required
+@http_cache.conditional(http_cache.analysis_stamp)
 def quiz():
-    user = User.query.get(session["user_id"])
-    quizzes = Quiz.query.all()
-    return render_template("quiz/quiz.html",  user=user, quizzes=quizzes)
+    # question lists are collapsed and fetched by quiz_questions when opened
+    page = pagination.sequence_page(catalog.get_catalog().quizzes, attrgetter("quiz_id"),
+                                    app.config['LIST_PAGE_SIZE'])
+    quiz_ids = [quiz.quiz_id for quiz in page.items]
+    analyses = {a.quiz_id: a for a in QuizAnalysis.query.filter(QuizAnalysis.quiz_id.in_(quiz_ids))}
+    return render_template("quiz/quiz.html", quizzes=page.items, analyses=analyses, page=page)
+
+@app.route("/admin/quiz/<int:quiz_id>/questions")
+@admin_required
+@http_cache.conditional(http_cache.analysis_stamp)
+def quiz_questions(quiz_id):
+    quiz = catalog.get_catalog().quizzes_by_id.get(quiz_id)
+    if not quiz:
+        abort(404)
+    page = pagination.sequence_page(quiz.questions, attrgetter("question_id"),
+                                    app.config['QUESTION_PAGE_SIZE'])
+    question_ids = [question.question_id for question in page.items]
+    items = {i.question_id: i for i in ItemAnalysis.query.filter(ItemAnalysis.question_id.in_(question_ids))}
+    return render_template("quiz/questions.html", quiz=quiz, questions=page.items, items=items,
+                           page=page)
+
+@app.route("/admin/quiz/<int:quiz_id>/analysis")
+@admin_required
+def quiz_analysis(quiz_id):
+    quiz = catalog.get_catalog().quizzes_by_id.get(quiz_id)
+    if not quiz:
+        flash("The quiz does not exist")
+        return redirect(url_for("quiz"))
+
+    analysis = db.session.get(QuizAnalysis, quiz_id)
+    items = {i.question_id: i for i in ItemAnalysis.query.filter_by(quiz_id=quiz_id)}
+    correct = dict(zip(*(a.tolist() for a in answer_key.get_answer_key(quiz_id))))
+    rows = []
+    for question in quiz.questions:
+        item = items.get(question.question_id)
+        notes = item_analysis.review_notes(item, correct[question.question_id]) if item else []
+        rows.append((question, correct[question.question_id], item, notes))
+    chart_ready, chart_version = charts.get_chart("quiz", quiz_id)
+    return render_template("quiz/analysis.html", quiz=quiz, analysis=analysis, rows=rows,
+                           chart_url=url_for("quiz_chart", quiz_id=quiz_id, v=chart_version),
+                           chart_ready=chart_ready)
+
+@app.route("/admin/quiz/<int:quiz_id>/analysis", methods=["POST"])
+@admin_required
+def quiz_analysis_post(quiz_id):
+    attempts_analyzed = item_analysis.analyze_quiz(quiz_id)
+    flash(f"Item analysis updated successfully from {attempts_analyzed} attempts")
+    return redirect(url_for("quiz_analysis", quiz_id=quiz_id))
 
 @app.route("/admin/quiz/add")
 @admin_required
 def add_quiz():
-    user = User.query.get(session["user_id"])
-    return render_template("quiz/add.html", user=user)
+    return render_template("quiz/add.html")
 
 @app.route("/admin/quiz/add", methods=["POST"])
 @admin_required
 def add_quiz_post():
-    user = User.query.get(session["user_id"])
     chap_id = request.form.get("chapter_id")
     date = request.form.get("date")
     duration = request.form.get("duration")
@@ -319,6 +440,7 @@ def add_quiz_post():
     
     quiz = Quiz(chapter_id=chap_id, date_of_quiz=parsed_date, time_duration=duration)
     db.session.add(quiz)
+    catalog.bump_version()
     db.session.commit()
     
     flash("Quiz added successfully")
@@ -327,8 +449,7 @@ def add_quiz_post():
 @app.route("/admin/quiz/<int:quiz_id>/edit")
 @admin_required
 def edit_quiz(quiz_id):
-    user = User.query.get(session["user_id"])
-    return render_template("quiz/edit.html", user=user)
+    return render_template("quiz/edit.html")
 
 @app.route("/admin/quiz/<int:quiz_id>/edit", methods=["POST"])
 @admin_required
@@ -353,6 +474,7 @@ def edit_quiz_post(quiz_id):
     
     quiz.date_of_quiz=parsed_date 
     quiz.time_duration=duration
+    catalog.bump_version()
     db.session.commit()
 
     flash("Quiz edited successfully.")
@@ -366,16 +488,19 @@ def delete_quiz(quiz_id):
         flash("The quiz does not exist")
         return redirect(url_for("admin"))
     
-    db.session.delete(quiz)
+    queued = deletes.delete_tree(quiz_id=quiz_id)
+    catalog.bump_version()
     db.session.commit()
+    answer_key.invalidate(quiz_id)
+    if queued:
+        deletes.start_purge()
     flash("Quiz deleted successfully")
     return redirect(url_for("quiz"))
 
 @app.route("/admin/quiz/<int:quiz_id>/question/add")
 @admin_required
 def add_question(quiz_id):
-    user = User.query.get(session["user_id"])
-    return render_template("question/add.html", user=user)
+    return render_template("question/add.html")
 
 @app.route("/admin/quiz/<int:quiz_id>/question/add", methods=["POST"])
 @admin_required
@@ -400,7 +525,9 @@ def add_question_post(quiz_id):
     question = Question(quiz_id=quiz_id, question_statement=statement, option1=option1, 
                 option2=option2, option3=option3, option4=option4, correct_option=correct_option)
     db.session.add(question)
+    catalog.bump_version()
     db.session.commit()
+    answer_key.invalidate(quiz_id)
 
     flash("Question added successfully")
     return redirect(url_for("quiz"))
@@ -408,8 +535,7 @@ def add_question_post(quiz_id):
 @app.route("/admin/quiz/<int:quiz_id>/question/edit/<int:question_id>")
 @admin_required
 def edit_question(quiz_id, question_id):
-    user = User.query.get(session["user_id"])
-    return render_template("question/edit.html", user=user)
+    return render_template("question/edit.html")
 
 @app.route("/admin/quiz/<int:quiz_id>/question/edit/<int:question_id>", methods=["POST"])
 @admin_required
@@ -437,7 +563,9 @@ def edit_question_post(quiz_id, question_id):
     question.option4 = option4
     question.correct_option = correct_option
 
+    catalog.bump_version()
     db.session.commit()
+    answer_key.invalidate(quiz_id)
     flash("Question edited successfully")
     return redirect(url_for("quiz"))
 
@@ -451,113 +579,342 @@ def delete_question(question_id, quiz_id):
         return redirect(url_for("admin"))
     
     db.session.delete(question)
+    catalog.bump_version()
     db.session.commit()
+    answer_key.invalidate(quiz_id)
     flash("Question deleted successfully")
     return redirect(url_for("quiz"))
 
 
 
+@app.route("/admin/question/import")
+@admin_required
+def import_questions():
+    return render_template("question/import.html")
+
+@app.route("/admin/question/import", methods=["POST"])
+@admin_required
+def import_questions_post():
+    upload = request.files.get("file")
+    if not upload or not upload.filename:
+        flash("Please choose a CSV or JSON-lines file")
+        return redirect(url_for("import_questions"))
+
+    report = bulk_import.import_upload(upload)
+    if not report.failed:
+        flash(f"Import finished successfully: {report.imported} questions added")
+    elif report.imported:
+        flash(f"Import finished with errors: {report.imported} questions added, {report.failed} rows failed")
+    else:
+        flash(f"Nothing was imported, {report.failed} rows failed")
+    return render_template("question/import.html", report=report)
+
+
+
+@app.route("/admin/export")
+@admin_required
+def export_page():
+    return render_template("export.html")
+
+@app.route("/admin/export/scores")
+@admin_required
+def export_scores():
+    file_format = request.args.get("format", "csv")
+    if file_format not in ("csv", "ndjson"):
+        flash("Export format should be csv or ndjson")
+        return redirect(url_for("export_page"))
+
+    try:
+        queries = export.scores_queries(
+            quiz_id=request.args.get("quiz_id", type=int),
+            subject_id=request.args.get("subject_id", type=int),
+            date_from=export.parse_date(request.args.get("date_from")),
+            date_to=export.parse_date(request.args.get("date_to")))
+    except ValueError:
+        flash("Invalid date format")
+        return redirect(url_for("export_page"))
+
+    rows = export.iter_rows(*queries)
+    chunks = export.iter_csv(rows) if file_format == "csv" else export.iter_ndjson(rows)
+    mimetype = "text/csv" if file_format == "csv" else "application/x-ndjson"
+    headers = {"Content-Disposition": f"attachment; filename=scores.{file_format}"}
+
+    if "gzip" in request.accept_encodings:
+        chunks = export.gzip_stream(chunks)
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+
+    # stream_with_context keeps the database session open while the response is generated
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+
+
+
+@app.route("/admin/metrics/group_commit")
+@admin_required
+def group_commit_metrics():
+    return jsonify(enabled=app.config['SCORE_GROUP_COMMIT'], **group_commit.writer.metrics())
+
+@app.route("/admin/metrics/passwords")
+@admin_required
+def password_metrics():
+    return jsonify(method=passwords.hash_method(), **passwords.pool.metrics())
+
+@app.route("/admin/metrics")
+@admin_required
+def request_metrics():
+    return render_template("metrics.html", endpoints=instrumentation.registry.snapshot(),
+                           started_at=datetime.fromtimestamp(instrumentation.registry.started_at),
+                           sample_rate=app.config['METRICS_SAMPLE_RATE'])
+
+@app.route("/admin/metrics/reset", methods=["POST"])
+@admin_required
+def reset_request_metrics():
+    instrumentation.registry.reset()
+    flash("Metrics reset successfully")
+    return redirect(url_for("request_metrics"))
+
+@app.route("/metrics")
+def prometheus_metrics():
+    # readable by a signed in admin, or by a scraper holding METRICS_TOKEN
+    token = app.config['METRICS_TOKEN']
+    authorised = token and request.headers.get("Authorization") == f"Bearer {token}"
+    if not authorised:
+        user = current_user()
+        if not user or not user.is_admin:
+            return Response("Forbidden\n", status=403, mimetype="text/plain")
+    return Response(instrumentation.prometheus_text(), mimetype="text/plain; version=0.0.4")
+
+
+
 # ------------ User pages ------------
 
 
 @app.route("/user")
 @auth_required
+@http_cache.conditional(http_cache.catalog_stamp)
 def user():
-    user = User.query.get(session["user_id"])
+    user = current_user()
     if user.is_admin == True:
         return redirect(url_for("admin"))
     
-    quizzes = Quiz.query.all()
-    return render_template("user_dashboard.html", user=user, quizzes=quizzes)
+    return render_template("user_dashboard.html", quizzes=catalog.get_catalog().quizzes)
 
 @app.route("/user/view_quiz/<int:quiz_id>/<int:chapter_id>")
 @auth_required
+@http_cache.conditional(http_cache.catalog_stamp)
 def view_quiz(quiz_id, chapter_id):
-    user = User.query.get(session["user_id"])
-    quiz = Quiz.query.get(quiz_id)
-    chapter = Chapter.query.get(chapter_id)
-    subject = Subject.query.filter_by(subject_id=Chapter.query.get(chapter_id).subject_id).first()
-    questions = Question.query.all()
-    return render_template("user_quiz/view.html", user=user, quiz=quiz, 
-                           chapter=chapter, subject=subject, questions=questions)
+    quiz = catalog.quiz_metadata(quiz_id)
+    if not quiz:
+        flash("The quiz does not exist")
+        return redirect(url_for("user"))
+    return render_template("user_quiz/view.html", quiz=quiz)
+
+
+@app.route("/user/quiz/<int:quiz_id>/metadata")
+@auth_required
+@http_cache.conditional(http_cache.catalog_stamp)
+def quiz_metadata(quiz_id):
+    quiz = catalog.quiz_metadata(quiz_id)
+    if not quiz:
+        return jsonify(error="The quiz does not exist"), 404
+    if quiz["date_of_quiz"]:
+        quiz["date_of_quiz"] = quiz["date_of_quiz"].isoformat()
+    return jsonify(quiz)
 
 
 @app.route("/user/start_quiz/<int:quiz_id>")
 @auth_required
 def start_quiz(quiz_id):
-    user = User.query.get(session["user_id"])
-    quiz = Quiz.query.get(quiz_id)
-    questions = Question.query.filter_by(quiz_id=quiz_id).all()
-    duration = Quiz.query.get(quiz_id).time_duration
-    start_time = datetime.now()
-    end_time = start_time + timedelta(minutes=duration)
+    quiz = catalog.quiz_metadata(quiz_id)
+    if not quiz:
+        flash("The quiz does not exist")
+        return redirect(url_for("user"))
+
+    # the deadline is recorded server side and enforced when the quiz is graded
+    attempt = attempts.start_attempt(current_user().user_id, quiz_id, quiz["time_duration"])
+
+    if quiz["question_count"] > app.config['LARGE_QUIZ_QUESTIONS']:
+        # large quizzes are answered page by page, the answers are kept with the attempt
+        return redirect(url_for("start_quiz_page", quiz_id=quiz_id, page=1))
+
+    # the question markup is shared by every student, only the timing is rendered per request
+    paper = paper_cache.get_paper(quiz_id)
    
-    return render_template("user_quiz/start.html", user=user, quiz=quiz, 
-                           questions=questions, end_time=end_time)
+    return render_template("user_quiz/start.html", quiz=quiz, paper=paper, attempt=attempt,
+                           end_time=attempt.deadline, saved=attempts.saved_answers(attempt))
+
+
+@app.route("/user/start_quiz/<int:quiz_id>/page/<int:page>")
+@auth_required
+def start_quiz_page(quiz_id, page):
+    quiz = catalog.quiz_metadata(quiz_id)
+    attempt = attempts.get_attempt(current_user().user_id, quiz_id)
+    if not quiz or not attempt:
+        flash("Please start the quiz first.")
+        return redirect(url_for("user"))
+
+    pages = paper_cache.page_count(quiz["question_count"])
+    page = min(max(page, 1), pages)
+    paper = paper_cache.get_paper(quiz_id, page)
+
+    return render_template("user_quiz/start.html", quiz=quiz, paper=paper, attempt=attempt,
+                           end_time=attempt.deadline, page=page, pages=pages,
+                           saved=attempts.saved_answers(attempt))
+
+
+@app.route("/user/start_quiz/<int:quiz_id>/page/<int:page>", methods=["POST"])
+@auth_required
+def start_quiz_page_post(quiz_id, page):
+    attempt = attempts.get_attempt(current_user().user_id, quiz_id)
+    if not attempt:
+        flash("Please start the quiz first.")
+        return redirect(url_for("user"))
+
+    go = request.form.get("go")
+    if go == "submit" or not attempts.is_open(attempt):
+        return submit_quiz(quiz_id, attempts.form_answers(request.form))
+
+    attempts.save_answers(attempt, request.form)
+    next_page = int(go) if go and go.isdigit() else page
+    return redirect(url_for("start_quiz_page", quiz_id=quiz_id, page=next_page))
+
+
+@app.route("/user/attempt/<int:attempt_id>/autosave", methods=["POST"])
+@auth_required
+def autosave(attempt_id):
+    answers = request.get_json(silent=True)
+    if not isinstance(answers, dict):
+        return jsonify(error="Expected a JSON object of question id to option"), 400
+
+    answers = attempts.form_answers({str(key): str(value) for key, value in answers.items()})
+    if not attempts.autosave(session["user_id"], attempt_id, answers):
+        return jsonify(error="The attempt is closed"), 409
+    return jsonify(saved=len(answers))
 
 
 @app.route("/user/start_quiz/<int:quiz_id>", methods=["POST"])
 @auth_required
 def start_quiz_post(quiz_id):
-    user = User.query.get(session["user_id"])
-    questions = Question.query.filter_by(quiz_id=quiz_id).all()
-
-
-    score = 0
-    total_questions = len(questions)
-
-    for question in questions:
-        question_key = f'{question.question_id}'
-        user_answer = request.form.get(question_key)
-        if user_answer:
-            try:
-                if int(user_answer) == question.correct_option:
-                    score += 1
-            except ValueError:
-                print("Invalid answer format")
-                print(user_answer)
-                flash("Something went wrong")
-                return redirect(url_for("user"))
+    return submit_quiz(quiz_id, attempts.form_answers(request.form))
 
-    
-    perc_score = int((score / total_questions) * 100)
-    time = datetime.now()
 
-    total = Score(quiz_id=quiz_id, user_id=user.user_id, 
-                  total_score=perc_score, time_stamp_of_attempt=time)
-    db.session.add(total)
-    db.session.commit()
+def submit_quiz(quiz_id, answers):
+    user = current_user()
+    user_id = user.user_id
+    attempt = attempts.get_attempt(user_id, quiz_id)
+    if not attempt:
+        flash("Please start the quiz first.")
+        return redirect(url_for("user"))
+
+    late = not attempts.is_open(attempt)
+    attempt_id = attempt.attempt_id
+    answers = attempts.collect_answers(attempt, answers)
+
+    try:
+        score, total_questions, answer_sheet = answer_key.grade(quiz_id, answers)
+    except (ValueError, OverflowError):
+        print("Invalid answer format")
+        flash("Something went wrong")
+        return redirect(url_for("user"))
 
-    flash("Quiz successfully submitted. You can check your score in the 'Score' Tab")
+    perc_score = int((score / total_questions) * 100) if total_questions else 0
+    time = datetime.now()
+
+    try:
+        saved = group_commit.save_score(quiz_id, user_id, perc_score, time, answer_sheet, attempt_id)
+    except SQLAlchemyError:
+        # the attempt is kept, so the quiz can be submitted again
+        app.logger.exception("Saving the score of quiz %s failed", quiz_id)
+        flash("Your answers could not be saved, please submit the quiz again.")
+        return redirect(url_for("start_quiz", quiz_id=quiz_id))
+
+    if late:
+        flash("Time was up, only the answers saved before the deadline were graded.")
+    if saved:
+        flash("Quiz successfully submitted. You can check your score in the 'Score' Tab")
+    else:
+        flash("Quiz submitted. Your score is still being saved and will show up in the 'Score' Tab shortly.")
     return redirect(url_for("user"))
 
 
 @app.route("/user/scores")
 @auth_required
+@http_cache.conditional(http_cache.score_stamp)
 def score():
-    user = User.query.get(session["user_id"])
-    scores = Score.query.filter_by(user_id=user.user_id).all()
-    
+    user = current_user()
+    # newest first, walks ix_score_user_id_time_stamp (score_id is the rowid it ends with)
+    page = pagination.keyset_page(
+        db.select(Score).filter_by(user_id=user.user_id),
+        [Score.time_stamp_of_attempt, Score.score_id],
+        lambda score: (score.time_stamp_of_attempt, score.score_id),
+        app.config['LIST_PAGE_SIZE'], descending=True)
+    # archived scores are summed up per week after the last page of recent ones
+    weeks = archive.user_weeks(user.user_id) if not page.next else []
+    return render_template("user_score.html", scores=page.items, page=page, weeks=weeks)
+
+
+@app.route("/user/leaderboard/<int:quiz_id>")
+@auth_required
+def leaderboard(quiz_id):
+    user = current_user()
+    quiz = Quiz.query.get(quiz_id)
+    if not quiz:
+        flash("The quiz does not exist")
+        return redirect(url_for("user"))
+
+    top = stats.top_scores(quiz_id)
+    histogram = stats.get_quiz_histogram(quiz_id)
+    # archived attempts are the older ones
+    scores = [score for model in (ScoreArchive, Score)
+              for score in model.query.filter_by(user_id=user.user_id, quiz_id=quiz_id)
+              .order_by(model.time_stamp_of_attempt)]
+    attempts = [(score, stats.percentile(histogram, score.total_score)) for score in scores]
 
-    return render_template("user_score.html", user=user, scores=scores)
+    return render_template("user_quiz/leaderboard.html", quiz=quiz, top=top,
+                           attempts=attempts, total_attempts=sum(histogram.values()))
 
 
 @app.route("/user/summary")
 @auth_required
+@http_cache.conditional(http_cache.score_stamp)
 def summary():
-    user = User.query.get(session["user_id"])
-    scores = [score.total_score for score in Score.query.filter_by(user_id=User.query.get(session["user_id"]).user_id).all()]
-    max_score = 0
-    total = 0
-    for score in scores:
-        total += score
-        if score > max_score:
-            max_score = score
-
-    len_scores = len(scores)
+    user = current_user()
+    len_scores, total, max_score, histogram = stats.get_user_stats(user.user_id)
+
     avg_score = 0
     if len_scores:
         avg_score = total / len_scores
     
-    return render_template("summary.html", user=user, len_scores=len_scores, 
-                           max_score=max_score, avg_score=avg_score)
\ No newline at end of file
+    chart_ready, chart_version = charts.get_chart("user", user.user_id) if len_scores else (None, 0)
+    return render_template("summary.html", len_scores=len_scores, 
+                           max_score=max_score, avg_score=avg_score, histogram=histogram,
+                           chart_url=url_for("user_chart", user_id=user.user_id, v=chart_version),
+                           chart_ready=chart_ready)
+
+
+# ------------ Charts ------------
+
+def chart_response(kind, obj_id):
+    path, version = charts.get_chart(kind, obj_id)
+    if not path:
+        # drawn in the background, the page polls until it is ready
+        return Response(charts.PLACEHOLDER, status=202, mimetype="image/svg+xml",
+                        headers={"Cache-Control": "no-store", "Retry-After": "1"})
+    # the versioned URL changes with every new score, so the browser may keep it
+    current = request.args.get("v") == str(version)
+    return send_file(path, mimetype=charts.MIMETYPES[app.config['CHART_FORMAT']],
+                     max_age=86400 if current else 0)
+
+@app.route("/user/chart/<int:user_id>")
+@auth_required
+def user_chart(user_id):
+    user = current_user()
+    if user_id != user.user_id and not user.is_admin:
+        flash("You are not authorised to access this page.")
+        return redirect(url_for("user"))
+    return chart_response("user", user_id)
+
+@app.route("/admin/quiz/<int:quiz_id>/chart")
+@admin_required
+def quiz_chart(quiz_id):
+    return chart_response("quiz", quiz_id)
@@ -0,0 +1,127 @@
+import re
+
+from sqlalchemy import text
+
+from app import app
+from application.models import db
+from application import pagination
+
+
+# ------------ Full-text search index ------------
+
+# Every searchable row lives in one FTS5 table. The rowid packs the source row id
+# and its kind (rowid = id * 4 + kind) so a row is found without scanning the index.
+KINDS = {"subject": 0, "chapter": 1, "user": 2, "question": 3}
+KIND_NAMES = {code: name for name, code in KINDS.items()}
+
+# (kind, table, id column, title column, body columns)
+SOURCES = [
+    ("subject", "subject", "subject_id", "name", ["description"]),
+    ("chapter", "chapter", "chapter_id", "name", ["description"]),
+    ("user", "user", "user_id", "username", ["name"]),
+    ("question", "question", "question_id", "question_statement",
+     ["option1", "option2", "option3", "option4"]),
+]
+
+CREATE_INDEX = """
+CREATE VIRTUAL TABLE search_index USING fts5(
+    title, body, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+)
+"""
+
+
+def source_values(kind, id_column, title, body, row=""):
+    # the select list for one source row, columns prefixed with new./old. inside triggers
+    body = " || ' ' || ".join(f"coalesce({row}{column}, '')" for column in body)
+    return f"{row}{id_column} * 4 + {KINDS[kind]}, {row}{title}, {body}"
+
+
+def trigger_statements(kind, table, id_column, title, body):
+    insert = ("INSERT INTO search_index(rowid, title, body) "
+              f"VALUES ({source_values(kind, id_column, title, body, 'new.')});")
+    delete = f"DELETE FROM search_index WHERE rowid = old.{id_column} * 4 + {KINDS[kind]};"
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS search_{table}_insert AFTER INSERT ON "{table}" '
+        f'BEGIN {insert} END',
+        f'CREATE TRIGGER IF NOT EXISTS search_{table}_update AFTER UPDATE ON "{table}" '
+        f'BEGIN {delete} {insert} END',
+        f'CREATE TRIGGER IF NOT EXISTS search_{table}_delete AFTER DELETE ON "{table}" '
+        f'BEGIN {delete} END',
+    ]
+
+
+def ensure_search_index():
+    # the triggers keep the index in step with every insert, update and delete,
+    # including the bulk import and cascading deletes
+    if db.engine.dialect.name != "sqlite":
+        return
+    exists = db.session.scalar(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'"))
+    if not exists:
+        db.session.execute(text(CREATE_INDEX))
+    for source in SOURCES:
+        for statement in trigger_statements(*source):
+            db.session.execute(text(statement))
+    db.session.commit()
+    if not exists:
+        rebuild_search_index()
+
+
+def rebuild_search_index():
+    db.session.execute(text("DELETE FROM search_index"))
+    for kind, table, id_column, title, body in SOURCES:
+        db.session.execute(text(
+            f'INSERT INTO search_index(rowid, title, body) '
+            f'SELECT {source_values(kind, id_column, title, body)} FROM "{table}"'))
+    db.session.execute(text("INSERT INTO search_index(search_index) VALUES ('optimize')"))
+    db.session.commit()
+
+
+def match_expression(query):
+    # every word must match, the last characters of each word may be left out
+    words = re.findall(r"\w+", query or "")
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def search(query, kinds):
+    """Return a Page of (kind, id, title, snippet) ranked by bm25.
+
+    Pages are keyed by (rank, rowid), the cursors come from the current request.
+    """
+    per_page = app.config['LIST_PAGE_SIZE']
+    expression = match_expression(query)
+    if not expression:
+        return pagination.Page([])
+
+    after, before = pagination.request_cursors(2)
+    codes = ", ".join(str(KINDS[kind]) for kind in kinds)
+    where = f"search_index MATCH :expression AND rowid % 4 IN ({codes})"
+    params = dict(expression=expression, limit=per_page + 1)
+    if after is not None:
+        where += " AND (rank, rowid) > (:rank, :rowid)"
+        params.update(rank=after[0], rowid=after[1])
+    elif before is not None:
+        where += " AND (rank, rowid) < (:rank, :rowid)"
+        params.update(rank=before[0], rowid=before[1])
+    order = "rank DESC, rowid DESC" if before is not None else "rank, rowid"
+    rows = db.session.execute(text(
+        f"SELECT rowid, title, snippet(search_index, 1, '', '', '...', 12), rank "
+        f"FROM search_index WHERE {where} ORDER BY {order} LIMIT :limit"), params).all()
+
+    page = pagination.make_page(rows, lambda row: (row[3], row[0]), after, before, per_page)
+    page.items = [(KIND_NAMES[rowid % 4], rowid // 4, title, snippet)
+                  for rowid, title, snippet, _ in page.items]
+    return page
+
+
+def search_ids(query, kind):
+    page = search(query, [kind])
+    page.items = [ref_id for _, ref_id, _, _ in page.items]
+    return page
+
+
+@app.cli.command("rebuild-search")
+def rebuild_search_command():
+    """Rebuild the full-text search index from scratch."""
+    rebuild_search_index()
+    print("Search index rebuilt.")
@@ -0,0 +1,205 @@
+from collections import Counter
+
+from sqlalchemy.dialects.sqlite import insert
+
+from app import app
+from application.models import db, User, Score, ScoreArchive, UserStats, UserScoreBucket, QuizScoreBucket, \
+    UserScoreRollup, QuizScoreRollup
+
+
+# ------------ Per-user score statistics ------------
+
+def score_bucket(total_score):
+    return min(max(total_score, 0) // 10, 10)
+
+
+def record_score(user_id, total_score):
+    # runs inside the caller's transaction, next to the Score insert
+    stats = insert(UserStats).values(user_id=user_id, attempts=1, score_sum=total_score,
+                                     max_score=total_score)
+    db.session.execute(stats.on_conflict_do_update(
+        index_elements=[UserStats.user_id],
+        set_=dict(attempts=UserStats.attempts + 1,
+                  score_sum=UserStats.score_sum + total_score,
+                  max_score=db.func.max(UserStats.max_score, total_score))))
+
+    bucket = insert(UserScoreBucket).values(user_id=user_id, bucket=score_bucket(total_score),
+                                            count=1)
+    db.session.execute(bucket.on_conflict_do_update(
+        index_elements=[UserScoreBucket.user_id, UserScoreBucket.bucket],
+        set_=dict(count=UserScoreBucket.count + 1)))
+
+
+def forget_scores(scores):
+    """Take deleted scores, (user_id, total_score) pairs, back out of the user statistics.
+
+    Runs inside the caller's transaction, after the scores (and, for archived ones,
+    their rollups) are gone, so the highest remaining score can be looked up.
+    """
+    totals = Counter()
+    attempts = Counter()
+    buckets = Counter()
+    for user_id, total_score in scores:
+        if user_id is not None:
+            attempts[user_id] += 1
+            totals[user_id] += total_score or 0
+            buckets[(user_id, score_bucket(total_score or 0))] += 1
+    if not attempts:
+        return
+
+    stats = UserStats.__table__
+    db.session.execute(
+        db.update(stats).where(stats.c.user_id == db.bindparam("user"))
+        .values(attempts=stats.c.attempts - db.bindparam("count"),
+                score_sum=stats.c.score_sum - db.bindparam("total")),
+        [dict(user=user_id, count=count, total=totals[user_id])
+         for user_id, count in attempts.items()])
+    bucket_table = UserScoreBucket.__table__
+    db.session.execute(
+        db.update(bucket_table)
+        .where(bucket_table.c.user_id == db.bindparam("user"),
+               bucket_table.c.bucket == db.bindparam("score_bucket"))
+        .values(count=bucket_table.c.count - db.bindparam("removed")),
+        [dict(user=user_id, score_bucket=bucket, removed=count)
+         for (user_id, bucket), count in buckets.items()])
+
+    user_ids = list(attempts)
+    db.session.execute(db.delete(UserScoreBucket).filter(UserScoreBucket.user_id.in_(user_ids),
+                                                         UserScoreBucket.count <= 0))
+    db.session.execute(db.delete(UserStats).filter(UserStats.user_id.in_(user_ids),
+                                                   UserStats.attempts <= 0))
+    # the maximum cannot be subtracted, it is looked up again among the remaining scores
+    hot = (db.select(db.func.max(Score.total_score))
+           .filter(Score.user_id == UserStats.user_id).scalar_subquery())
+    archived = (db.select(db.func.max(UserScoreRollup.max_score))
+                .filter(UserScoreRollup.user_id == UserStats.user_id,
+                        UserScoreRollup.period == "day").scalar_subquery())
+    db.session.execute(
+        db.update(UserStats).filter(UserStats.user_id.in_(user_ids))
+        .values(max_score=db.func.max(db.func.coalesce(hot, 0), db.func.coalesce(archived, 0)))
+        .execution_options(synchronize_session=False))
+
+
+def get_user_stats(user_id):
+    stats = db.session.get(UserStats, user_id)
+    buckets = db.session.execute(
+        db.select(UserScoreBucket.bucket, UserScoreBucket.count).filter_by(user_id=user_id)
+    ).all()
+    histogram = [0] * 11
+    for bucket, count in buckets:
+        histogram[bucket] = count
+    if not stats:
+        return 0, 0, 0, histogram
+    return stats.attempts, stats.score_sum, stats.max_score, histogram
+
+
+def archived_histogram(model, owner):
+    # (owner id, total_score, count) from the daily rollups of archived scores
+    entries = db.func.json_each(model.histogram).table_valued("key", "value")
+    return (db.select(owner, db.cast(entries.c.key, db.Integer).label("score"),
+                      db.func.sum(entries.c.value).label("count"))
+            .join(entries, db.true())
+            .filter(model.period == "day")
+            .group_by(owner, entries.c.key))
+
+
+def rebuild_user_stats():
+    # hot scores plus the rollups of archived ones, which hold the same totals
+    db.session.execute(db.delete(UserStats))
+    db.session.execute(db.delete(UserScoreBucket))
+
+    totals = db.union_all(
+        db.select(Score.user_id, db.func.count().label("attempts"),
+                  db.func.sum(Score.total_score).label("score_sum"),
+                  db.func.max(Score.total_score).label("max_score"))
+        .filter(Score.user_id.is_not(None))
+        .group_by(Score.user_id),
+        db.select(UserScoreRollup.user_id, db.func.sum(UserScoreRollup.attempts),
+                  db.func.sum(UserScoreRollup.score_sum), db.func.max(UserScoreRollup.max_score))
+        .filter_by(period="day")
+        .group_by(UserScoreRollup.user_id),
+    ).subquery()
+    db.session.execute(insert(UserStats).from_select(
+        ["user_id", "attempts", "score_sum", "max_score"],
+        db.select(totals.c.user_id, db.func.sum(totals.c.attempts), db.func.sum(totals.c.score_sum),
+                  db.func.max(totals.c.max_score))
+        .group_by(totals.c.user_id)))
+
+    scores = db.union_all(
+        db.select(Score.user_id, Score.total_score.label("score"), db.func.count().label("count"))
+        .filter(Score.user_id.is_not(None))
+        .group_by(Score.user_id, Score.total_score),
+        archived_histogram(UserScoreRollup, UserScoreRollup.user_id),
+    ).subquery()
+    bucket = db.func.min(db.func.max(scores.c.score, 0) // 10, 10)
+    db.session.execute(insert(UserScoreBucket).from_select(
+        ["user_id", "bucket", "count"],
+        db.select(scores.c.user_id, bucket, db.func.sum(scores.c.count))
+        .group_by(scores.c.user_id, bucket)))
+    db.session.commit()
+
+
+# ------------ Per-quiz leaderboard ------------
+
+def record_quiz_score(quiz_id, total_score):
+    # runs inside the caller's transaction, next to the Score insert
+    bucket = insert(QuizScoreBucket).values(quiz_id=quiz_id, score=total_score, count=1)
+    db.session.execute(bucket.on_conflict_do_update(
+        index_elements=[QuizScoreBucket.quiz_id, QuizScoreBucket.score],
+        set_=dict(count=QuizScoreBucket.count + 1)))
+
+
+def get_quiz_histogram(quiz_id):
+    # at most 101 rows whatever the number of attempts
+    rows = db.session.execute(
+        db.select(QuizScoreBucket.score, QuizScoreBucket.count).filter_by(quiz_id=quiz_id)
+    ).all()
+    return dict(rows)
+
+
+def percentile(histogram, total_score):
+    # share of attempts scoring below total_score, counting ties as half
+    attempts = sum(histogram.values())
+    if not attempts:
+        return 0
+    below = sum(count for score, count in histogram.items() if score < total_score)
+    equal = histogram.get(total_score, 0)
+    return round((below + equal / 2) / attempts * 100, 1)
+
+
+def top_scores(quiz_id, limit=10):
+    # served by the (quiz_id, total_score) indexes, so at most `limit` rows are read from
+    # the hot and the archived scores each
+    rows = []
+    for model in (Score, ScoreArchive):
+        rows += db.session.execute(
+            db.select(User.name, model.total_score, model.time_stamp_of_attempt, model.score_id)
+            .join(User, User.user_id == model.user_id)
+            .filter(model.quiz_id == quiz_id)
+            .order_by(model.total_score.desc(), model.score_id)
+            .limit(limit)
+        ).all()
+    return sorted(rows, key=lambda row: (-row.total_score, row.score_id))[:limit]
+
+
+def rebuild_quiz_stats():
+    db.session.execute(db.delete(QuizScoreBucket))
+    scores = db.union_all(
+        db.select(Score.quiz_id, Score.total_score.label("score"), db.func.count().label("count"))
+        .filter(Score.quiz_id.is_not(None), Score.total_score.is_not(None))
+        .group_by(Score.quiz_id, Score.total_score),
+        archived_histogram(QuizScoreRollup, QuizScoreRollup.quiz_id),
+    ).subquery()
+    db.session.execute(insert(QuizScoreBucket).from_select(
+        ["quiz_id", "score", "count"],
+        db.select(scores.c.quiz_id, scores.c.score, db.func.sum(scores.c.count))
+        .group_by(scores.c.quiz_id, scores.c.score)))
+    db.session.commit()
+
+
+@app.cli.command("rebuild-stats")
+def rebuild_stats_command():
+    """Recompute the per-user and per-quiz score statistics from the scores and rollups."""
+    rebuild_user_stats()
+    rebuild_quiz_stats()
+    print("User and quiz statistics rebuilt.")
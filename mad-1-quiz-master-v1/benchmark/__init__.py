@@ -0,0 +1,5 @@
+"""Synthetic data generator and load generator for the quiz app, see `python -m benchmark --help`."""
+from app import create_app
+
+# the models need the configured app, so wire it up before any benchmark module imports them
+app = create_app()
@@ -0,0 +1,92 @@
+import sys
+
+import click
+
+from benchmark import app, dataset, load, report
+
+
+@click.group()
+def cli():
+    """Generate synthetic data and load test the app against SQLALCHEMY_DATABASE_URI.
+
+    Point SQLALCHEMY_DATABASE_URI at a database used only for benchmarking.
+    """
+
+
+@cli.command()
+@click.option("--preset", type=click.Choice(sorted(dataset.PRESETS)), default="small",
+              show_default=True)
+@click.option("--subjects", type=int)
+@click.option("--chapters-per-subject", type=int)
+@click.option("--quizzes-per-chapter", type=int)
+@click.option("--questions", type=int)
+@click.option("--users", type=int)
+@click.option("--scores", type=int)
+@click.option("--seed", default=0, show_default=True)
+def generate(preset, seed, **sizes):
+    """Fill an empty database with a synthetic dataset, sizes override the preset."""
+    from application.bootstrap import init_db
+
+    settings = dict(dataset.PRESETS[preset])
+    settings.update({name: value for name, value in sizes.items() if value is not None})
+    with app.app_context():
+        init_db()
+        dataset.generate(seed=seed, **settings)
+        print(dataset.counts())
+
+
+@cli.command()
+@click.option("--scenario", "scenarios", multiple=True, type=click.Choice(sorted(load.SCENARIOS)),
+              help="Scenarios to run, all by default. Repeat for several.")
+@click.option("--processes", default=1, show_default=True)
+@click.option("--threads", default=4, show_default=True, help="Client threads per process.")
+@click.option("--duration", default=30.0, show_default=True, help="Timed seconds.")
+@click.option("--warmup", default=5.0, show_default=True, help="Untimed seconds before.")
+@click.option("--admin-password", default="admin", show_default=True)
+@click.option("--seed", default=0, show_default=True)
+@click.option("--output", type=click.Path(dir_okay=False), default="benchmark-results.json",
+              show_default=True)
+@click.option("--baseline", type=click.Path(exists=True, dir_okay=False),
+              help="Results to compare against, exits with status 1 on a regression.")
+@click.option("--threshold", default=0.1, show_default=True,
+              help="Allowed relative regression, 0.1 is 10%.")
+def run(scenarios, processes, threads, duration, warmup, admin_password, seed, output, baseline,
+        threshold):
+    """Load test the routes and write p50/p95/p99 latency, throughput and queries per endpoint."""
+    # sign-ins are only benchmarked when asked for, they mostly measure the hash cost
+    scenarios = list(scenarios or [name for name in load.SCENARIOS if name != "login"])
+    samples = load.run(processes, threads, scenarios, duration, warmup, admin_password, seed)
+    results = report.summarize(samples, duration)
+
+    with app.app_context():
+        counts = dataset.counts()
+    settings = dict(scenarios=scenarios, processes=processes, threads=threads, duration=duration,
+                    warmup=warmup, seed=seed, group_commit=app.config['SCORE_GROUP_COMMIT'],
+                    db_profile=app.config['DB_PROFILE'],
+                    password_hash_method=app.config['PASSWORD_HASH_METHOD'],
+                    password_hash_workers=app.config['PASSWORD_HASH_WORKERS'])
+    results_report = report.build_report(results, settings, counts)
+    report.save(results_report, output)
+    report.print_results(results)
+    print(f"Results written to {output}")
+
+    if baseline:
+        regressions = report.compare(results_report, report.load(baseline), threshold)
+        report.print_regressions(regressions, threshold)
+        sys.exit(1 if regressions else 0)
+
+
+@cli.command()
+@click.argument("results", type=click.Path(exists=True, dir_okay=False))
+@click.argument("baseline", type=click.Path(exists=True, dir_okay=False))
+@click.option("--threshold", default=0.1, show_default=True,
+              help="Allowed relative regression, 0.1 is 10%.")
+def compare(results, baseline, threshold):
+    """Compare saved results against a baseline, exits with status 1 on a regression."""
+    regressions = report.compare(report.load(results), report.load(baseline), threshold)
+    report.print_regressions(regressions, threshold)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    cli()
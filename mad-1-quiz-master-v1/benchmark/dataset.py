@@ -0,0 +1,103 @@
+import random
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+from application.models import db, User, Subject, Chapter, Quiz, Question, Score
+from application import catalog, stats
+
+
+# ------------ Synthetic dataset ------------
+
+PRESETS = {
+    "small": dict(subjects=20, chapters_per_subject=5, quizzes_per_chapter=2, questions=2000,
+                  users=1000, scores=20000),
+    "medium": dict(subjects=200, chapters_per_subject=5, quizzes_per_chapter=2, questions=10000,
+                   users=10000, scores=500000),
+    "large": dict(subjects=1000, chapters_per_subject=5, quizzes_per_chapter=2, questions=50000,
+                  users=100000, scores=5000000),
+}
+
+# rows per executemany
+CHUNK_SIZE = 10000
+
+# every generated student signs in with bench_user_<n> and this password
+PASSWORD = "bench"
+USERNAME = "bench_user_{}"
+
+
+def insert_rows(model, rows):
+    # rows is any iterable of dicts, inserted in chunks so memory stays flat
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            db.session.execute(db.insert(model), chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(db.insert(model), chunk)
+    db.session.commit()
+
+
+def ids(column):
+    return db.session.execute(db.select(column).order_by(column)).scalars().all()
+
+
+def generate(subjects, chapters_per_subject, quizzes_per_chapter, questions, users, scores,
+             seed=0, log=print):
+    """Fill an empty database with a deterministic synthetic dataset."""
+    if db.session.scalar(db.select(db.func.count()).select_from(Subject)):
+        raise ValueError("the database already has subjects, generate into an empty database")
+    rng = random.Random(seed)
+
+    log(f"{subjects} subjects, {subjects * chapters_per_subject} chapters")
+    insert_rows(Subject, (dict(name=f"Subject {s}", description=f"Synthetic subject {s}")
+                          for s in range(subjects)))
+    subject_ids = ids(Subject.subject_id)
+    insert_rows(Chapter, (dict(subject_id=subject_id, name=f"Chapter {s}.{c}",
+                               description=f"Synthetic chapter {c} of subject {s}")
+                          for s, subject_id in enumerate(subject_ids)
+                          for c in range(chapters_per_subject)))
+
+    chapter_ids = ids(Chapter.chapter_id)
+    log(f"{len(chapter_ids) * quizzes_per_chapter} quizzes")
+    today = datetime.now().date()
+    insert_rows(Quiz, (dict(chapter_id=chapter_id, date_of_quiz=today + timedelta(days=q),
+                            time_duration=rng.choice([10, 15, 30, 60]))
+                       for chapter_id in chapter_ids for q in range(quizzes_per_chapter)))
+
+    quiz_ids = ids(Quiz.quiz_id)
+    log(f"{questions} questions")
+    insert_rows(Question, (dict(quiz_id=quiz_ids[n % len(quiz_ids)],
+                                question_statement=f"Synthetic question {n}: which option is right?",
+                                option1=f"first answer {n}", option2=f"second answer {n}",
+                                option3=f"third answer {n}", option4=f"fourth answer {n}",
+                                correct_option=rng.randint(1, 4))
+                           for n in range(questions)))
+
+    log(f"{users} users")
+    # one hash for everybody, hashing every password would dominate the run
+    passhash = generate_password_hash(PASSWORD)
+    insert_rows(User, (dict(username=USERNAME.format(n), passhash=passhash, name=f"Student {n}",
+                            qualification="Synthetic", is_admin=False)
+                       for n in range(users)))
+
+    user_ids = db.session.execute(db.select(User.user_id).filter_by(is_admin=False)).scalars().all()
+    log(f"{scores} scores")
+    started = datetime.now() - timedelta(days=365)
+    insert_rows(Score, (dict(quiz_id=rng.choice(quiz_ids), user_id=rng.choice(user_ids),
+                             total_score=rng.randint(0, 100),
+                             time_stamp_of_attempt=started + timedelta(
+                                 seconds=rng.randrange(365 * 24 * 3600)))
+                        for _ in range(scores)))
+
+    log("score statistics")
+    stats.rebuild_user_stats()
+    stats.rebuild_quiz_stats()
+    catalog.bump_version()
+    db.session.commit()
+
+
+def counts():
+    return {model.__tablename__: db.session.scalar(db.select(db.func.count()).select_from(model))
+            for model in (Subject, Chapter, Quiz, Question, User, Score)}
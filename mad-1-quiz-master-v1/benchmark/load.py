@@ -0,0 +1,173 @@
+import multiprocessing
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import event
+
+from benchmark import app
+from application.models import db, User, Question
+from application import charts
+from benchmark.dataset import PASSWORD
+
+
+# ------------ Load generator ------------
+
+# Every scenario drives the real routes through a test client. A scenario is a list of
+# (endpoint name, method, url, form data) requests, each timed under its endpoint name.
+
+def admin_dashboard(worker):
+    return [("admin", "GET", "/admin", None)]
+
+
+def user_dashboard(worker):
+    return [("user", "GET", "/user", None)]
+
+
+def login(worker):
+    return [("login", "POST", "/", dict(username=worker.username, password=worker.password))]
+
+
+def summary(worker):
+    return [("summary", "GET", "/user/summary", None)]
+
+
+def submit_quiz(worker):
+    quiz_id, question_ids = worker.rng.choice(worker.quizzes)
+    answers = {str(question_id): str(worker.rng.randint(1, 4)) for question_id in question_ids}
+    return [("start_quiz", "GET", f"/user/start_quiz/{quiz_id}", None),
+            ("start_quiz_post", "POST", f"/user/start_quiz/{quiz_id}", answers)]
+
+
+SCENARIOS = {"admin": admin_dashboard, "user": user_dashboard, "summary": summary,
+             "start_quiz_post": submit_quiz, "login": login}
+ADMIN_SCENARIOS = {"admin"}
+
+
+class QueryCounter:
+    """Counts the SQL statements each thread executes."""
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.local.count = getattr(self.local, "count", 0) + 1
+
+    def count(self):
+        return getattr(self.local, "count", 0)
+
+
+class Worker:
+    def __init__(self, username, password, quizzes, seed):
+        self.client = app.test_client()
+        self.username = username
+        self.password = password
+        self.rng = random.Random(seed)
+        self.quizzes = quizzes
+        response = self.client.post("/", data=dict(username=username, password=password))
+        # a failed sign in redirects back to the sign in page
+        if not response.headers.get("Location", "").endswith("/user"):
+            raise RuntimeError(f"could not sign in as {username}")
+
+
+def sample_quizzes(limit=200):
+    # (quiz id, question ids) of quizzes that have questions
+    with app.app_context():
+        rows = db.session.execute(db.select(Question.quiz_id, Question.question_id)
+                                  .order_by(Question.quiz_id)).all()
+    quizzes = {}
+    for quiz_id, question_id in rows:
+        quizzes.setdefault(quiz_id, []).append(question_id)
+    return list(quizzes.items())[:limit]
+
+
+def student_names(count, offset):
+    with app.app_context():
+        return db.session.execute(
+            db.select(User.username).filter_by(is_admin=False).order_by(User.user_id)
+            .offset(offset).limit(count)).scalars().all()
+
+
+def run_process(process_index, threads, scenarios, duration, warmup, admin_password, seed):
+    """Run `threads` workers for `duration` seconds, returns their samples.
+
+    Samples are (endpoint, seconds, status code, queries) tuples.
+    """
+    counter = QueryCounter()
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", counter)
+
+    quizzes = sample_quizzes()
+    students = student_names(threads, process_index * threads)
+    if len(students) < threads:
+        raise RuntimeError("not enough students, generate a dataset first")
+
+    samples = []
+    errors = []
+    samples_lock = threading.Lock()
+    start_line = threading.Barrier(threads)
+
+    def run_thread(thread_index):
+        try:
+            run_requests(thread_index)
+        except Exception as error:
+            # release the other threads instead of leaving them at the start line
+            start_line.abort()
+            errors.append(error)
+
+    def run_requests(thread_index):
+        names = [s for s in scenarios if s not in ADMIN_SCENARIOS]
+        admin_names = [s for s in scenarios if s in ADMIN_SCENARIOS]
+        student = Worker(students[thread_index], PASSWORD, quizzes,
+                         seed + process_index * 1000 + thread_index)
+        admin = Worker("admin", admin_password, quizzes, seed) if admin_names else None
+        own = []
+
+        def request(client, method, url, data):
+            before = counter.count()
+            started = time.perf_counter()
+            response = client.open(url, method=method, data=data)
+            elapsed = time.perf_counter() - started
+            return elapsed, response.status_code, counter.count() - before
+
+        rotation = [(name, admin if name in ADMIN_SCENARIOS else student)
+                    for name in admin_names + names]
+        start_line.wait()
+        warmup_end = time.perf_counter() + warmup
+        end = warmup_end + duration
+        turn = 0
+        while time.perf_counter() < end:
+            name, worker = rotation[turn % len(rotation)]
+            turn += 1
+            timed = time.perf_counter() >= warmup_end
+            for endpoint, method, url, data in SCENARIOS[name](worker):
+                elapsed, status, queries = request(worker.client, method, url, data)
+                if timed:
+                    own.append((endpoint, elapsed, status, queries))
+        with samples_lock:
+            samples.extend(own)
+
+    pool = [threading.Thread(target=run_thread, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    # charts requested by the summary page are drawn by child processes of this one
+    charts.renderer.shutdown()
+    errors = [error for error in errors if not isinstance(error, threading.BrokenBarrierError)]
+    if errors:
+        raise errors[0]
+    return samples
+
+
+def run(processes, threads, scenarios, duration, warmup, admin_password, seed=0):
+    """Drive the app from processes x threads clients for `duration` timed seconds."""
+    if processes == 1:
+        return run_process(0, threads, scenarios, duration, warmup, admin_password, seed)
+    # spawned, so every process opens its own database connections
+    with ProcessPoolExecutor(max_workers=processes,
+                             mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(run_process, index, threads, scenarios, duration, warmup,
+                                   admin_password, seed) for index in range(processes)]
+        return [sample for future in futures for sample in future.result()]
@@ -0,0 +1,97 @@
+import json
+import platform
+from datetime import datetime
+
+
+# ------------ Results and baseline comparison ------------
+
+# metrics compared against the baseline, and whether a higher value is worse
+COMPARED = {"p50_ms": True, "p95_ms": True, "p99_ms": True, "throughput_rps": False,
+            "queries_per_request": True}
+
+
+def percentile(ordered, fraction):
+    # nearest-rank percentile of an already sorted list
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarize(samples, duration):
+    """Per-endpoint latency, throughput, error and query statistics of the samples."""
+    endpoints = {}
+    for endpoint, seconds, status, queries in samples:
+        endpoints.setdefault(endpoint, []).append((seconds, status, queries))
+
+    results = {}
+    for endpoint, rows in sorted(endpoints.items()):
+        latencies = sorted(seconds * 1000 for seconds, _, _ in rows)
+        queries = [count for _, _, count in rows]
+        results[endpoint] = dict(
+            requests=len(rows),
+            errors=sum(1 for _, status, _ in rows if status >= 400),
+            p50_ms=round(percentile(latencies, 0.50), 3),
+            p95_ms=round(percentile(latencies, 0.95), 3),
+            p99_ms=round(percentile(latencies, 0.99), 3),
+            max_ms=round(latencies[-1], 3),
+            throughput_rps=round(len(rows) / duration, 2),
+            queries_per_request=round(sum(queries) / len(queries), 2),
+            max_queries=max(queries),
+        )
+    return results
+
+
+def build_report(results, settings, dataset):
+    return dict(created_at=datetime.now().isoformat(timespec="seconds"),
+                python=platform.python_version(), settings=settings, dataset=dataset,
+                endpoints=results)
+
+
+def save(report, path):
+    with open(path, "w") as file:
+        json.dump(report, file, indent=2)
+
+
+def load(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare(report, baseline, threshold):
+    """Return [(endpoint, metric, baseline value, value, change)] of the regressions.
+
+    A metric regresses when it is worse than the baseline by more than `threshold`,
+    a fraction, e.g. 0.1 for 10%.
+    """
+    regressions = []
+    for endpoint, result in report["endpoints"].items():
+        before = baseline["endpoints"].get(endpoint)
+        if not before:
+            continue
+        for metric, higher_is_worse in COMPARED.items():
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (change if higher_is_worse else -change) > threshold:
+                regressions.append((endpoint, metric, old, new, change))
+    return regressions
+
+
+def print_results(results):
+    print(f"{'endpoint':18} {'requests':>8} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'req/s':>8} {'queries':>8}")
+    for endpoint, r in results.items():
+        print(f"{endpoint:18} {r['requests']:8} {r['errors']:6} {r['p50_ms']:8.1f} "
+              f"{r['p95_ms']:8.1f} {r['p99_ms']:8.1f} {r['throughput_rps']:8.1f} "
+              f"{r['queries_per_request']:8.1f}")
+
+
+def print_regressions(regressions, threshold):
+    if not regressions:
+        print(f"No regressions beyond {threshold:.0%} against the baseline.")
+        return
+    print(f"Regressions beyond {threshold:.0%} against the baseline:")
+    for endpoint, metric, old, new, change in regressions:
+        print(f"  {endpoint:18} {metric:20} {old:10.2f} -> {new:10.2f} ({change:+.0%})")
@@ -0,0 +1,67 @@
+import unittest
+
+from sqlalchemy import event
+
+from testing import app
+from application.models import db, User, Subject, Chapter
+from application import catalog
+
+
+class AdminDashboardQueryCount(unittest.TestCase):
+    """The admin dashboard runs the same number of statements whatever the catalog size."""
+
+    URLS = ["/admin", "/admin?parameter=ch_name&query=chapter"]
+
+    @classmethod
+    def setUpClass(cls):
+        with app.app_context():
+            cls.admin_id = db.session.scalar(db.select(User.user_id).filter_by(is_admin=True))
+        cls.subjects = 0
+
+    def setUp(self):
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session["user_id"] = self.admin_id
+
+    def add_subjects(self, count, chapters_per_subject):
+        with app.app_context():
+            for _ in range(count):
+                self.__class__.subjects += 1
+                number = self.subjects
+                subject = Subject(name=f"Subject {number}", description="subject")
+                subject.chapters = [Chapter(name=f"Chapter {number}.{chapter}", description="chapter")
+                                    for chapter in range(chapters_per_subject)]
+                db.session.add(subject)
+            catalog.bump_version()
+            db.session.commit()
+
+    def statement_counts(self):
+        counts = {}
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            for url in self.URLS:
+                statements.clear()
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200, url)
+                counts[url] = len(statements)
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+        return counts
+
+    def test_statement_count_does_not_grow_with_the_catalog(self):
+        self.add_subjects(2, 2)
+        small = self.statement_counts()
+        self.add_subjects(200, 5)
+        large = self.statement_counts()
+        self.assertEqual(small, large)
+
+
+if __name__ == "__main__":
+    unittest.main()
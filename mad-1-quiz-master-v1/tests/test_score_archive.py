@@ -0,0 +1,69 @@
+import itertools
+import unittest
+from datetime import datetime, timedelta
+
+from testing import app
+from application.models import db, User, Subject, Chapter, Quiz, Score, ScoreArchive, \
+    AnswerSheet, AnswerSheetArchive
+from application import archive, catalog, group_commit
+
+
+class ArchiveThenSubmit(unittest.TestCase):
+    """A score submitted after the newest scores were archived gets an id of its own."""
+
+    numbers = itertools.count(1)
+
+    def setUp(self):
+        with app.app_context():
+            self.user_id = db.session.scalar(db.select(User.user_id).filter_by(is_admin=True))
+            number = next(self.numbers)
+            subject = Subject(name=f"Archive subject {number}", description="subject")
+            subject.chapters = [Chapter(name=f"Archive chapter {number}", description="chapter",
+                                        quizzes=[Quiz(time_duration=10)])]
+            db.session.add(subject)
+            catalog.bump_version()
+            db.session.commit()
+            self.quiz_id = subject.chapters[0].quizzes[0].quiz_id
+
+    def tearDown(self):
+        app.config['SCORE_GROUP_COMMIT'] = False
+
+    def submit(self, days_ago):
+        with app.app_context():
+            self.assertTrue(group_commit.save_score(
+                self.quiz_id, self.user_id, 50, datetime.now() - timedelta(days=days_ago),
+                (1, b"\x01")))
+
+    def archive(self):
+        with app.app_context():
+            return archive.archive_scores(datetime.now() - timedelta(days=1), 100)
+
+    def archived(self, model):
+        with app.app_context():
+            return db.session.execute(db.select(model.score_id).filter_by(quiz_id=self.quiz_id)
+                                      .order_by(model.score_id)).scalars().all()
+
+    def check_archive_submit_archive(self):
+        self.submit(days_ago=10)
+        self.submit(days_ago=10)
+        self.assertEqual(self.archive(), 2)
+        self.submit(days_ago=5)
+        self.assertEqual(self.archive(), 1)
+
+        score_ids = self.archived(ScoreArchive)
+        self.assertEqual(len(score_ids), 3)
+        self.assertEqual(score_ids, sorted(set(score_ids)))
+        self.assertEqual(self.archived(AnswerSheetArchive), score_ids)
+        self.assertEqual(self.archived(Score), [])
+        self.assertEqual(self.archived(AnswerSheet), [])
+
+    def test_direct_commit(self):
+        self.check_archive_submit_archive()
+
+    def test_group_commit(self):
+        app.config['SCORE_GROUP_COMMIT'] = True
+        self.check_archive_submit_archive()
+
+
+if __name__ == "__main__":
+    unittest.main()
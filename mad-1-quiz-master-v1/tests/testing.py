@@ -0,0 +1,31 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+# the app reads its configuration from the environment once, when it is created,
+# so every test module shares this app and its database
+DATA_DIR = tempfile.mkdtemp(prefix="quiz-master-test-")
+os.environ["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(DATA_DIR, "test.db")
+os.environ["SECRET_KEY"] = "test"
+os.environ["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:1000"
+os.environ["CHART_CACHE_DIR"] = os.path.join(DATA_DIR, "charts")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+
+app = create_app()
+
+from application.bootstrap import init_db
+from application.models import db
+
+with app.app_context():
+    init_db()
+
+
+@atexit.register
+def remove_data_dir():
+    with app.app_context():
+        db.engine.dispose()
+    shutil.rmtree(DATA_DIR, ignore_errors=True)